@@ -83,4 +83,77 @@ $$ LANGUAGE plpgsql;
 -- Create a trigger that executes the reset function before user deletion
 CREATE TRIGGER trigger_reset_invites
 BEFORE DELETE ON user_data
-FOR EACH ROW EXECUTE FUNCTION reset_invite_hashes();
\ No newline at end of file
+FOR EACH ROW EXECUTE FUNCTION reset_invite_hashes();
+
+-- Create a table for group conversations
+CREATE TABLE IF NOT EXISTS conversations (
+    id SERIAL PRIMARY KEY,                           -- Auto-incrementing primary key
+    title VARCHAR(255) NOT NULL,                     -- Group title
+    created_by INT REFERENCES user_data(id) ON DELETE SET NULL,  -- User who created the group
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP  -- When the group was created
+);
+
+-- Create a table for group membership with per-member read cursors
+CREATE TABLE IF NOT EXISTS conversation_members (
+    conversation_id INT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,  -- Group ID
+    user_id INT NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,             -- Member ID
+    last_read_message_id INT NOT NULL DEFAULT 0,     -- Last group message the member has read
+    joined_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- When the member joined
+    PRIMARY KEY (conversation_id, user_id)
+);
+
+-- Create a table for group messages (stored once per post, not once per member)
+CREATE TABLE IF NOT EXISTS group_messages (
+    id SERIAL PRIMARY KEY,                           -- Auto-incrementing primary key
+    conversation_id INT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,  -- Target group
+    sender_id INT NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,            -- Message sender
+    content TEXT NOT NULL,                           -- The actual message content
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP  -- When the message was sent
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversation_members_user ON conversation_members(user_id);  -- Groups of a user
+CREATE INDEX IF NOT EXISTS idx_group_messages_conversation ON group_messages(conversation_id, id);  -- History pages
+
+
+-- Create a table for message attachments (file contents are stored on disk by SHA-256)
+CREATE TABLE IF NOT EXISTS attachments (
+    id SERIAL PRIMARY KEY,                           -- Auto-incrementing primary key
+    uploader_id INT NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,  -- User who uploaded the file
+    sha256 CHAR(64) NOT NULL,                        -- Content hash, also the storage key
+    size BIGINT NOT NULL,                            -- File size in bytes
+    mime_type VARCHAR(255) NOT NULL,                 -- Declared content type
+    filename VARCHAR(255) NOT NULL,                  -- Original file name
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP  -- When the upload completed
+);
+
+-- Messages reference attachments by ID instead of embedding file data
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS attachment_id INT REFERENCES attachments(id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS idx_messages_attachment ON messages(attachment_id) WHERE attachment_id IS NOT NULL;  -- Recipient access checks on download
+
+
+-- Large message bodies may be stored compressed (body_format: 0 plain, 1 zlib, 2 zstd, 3 zstd with dictionary)
+ALTER TABLE messages
+    ADD COLUMN IF NOT EXISTS body_format SMALLINT NOT NULL DEFAULT 0,  -- Storage format of the body
+    ADD COLUMN IF NOT EXISTS body_blob BYTEA;                          -- Compressed body, content is '' when set
+ALTER TABLE group_messages
+    ADD COLUMN IF NOT EXISTS body_format SMALLINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS body_blob BYTEA;
+
+
+-- Create a closure table of invite lineage (every ancestor/descendant pair, maintained on registration and deletion)
+CREATE TABLE IF NOT EXISTS user_invite_closure (
+    ancestor_id INT NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,    -- Inviter at any level above
+    descendant_id INT NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,  -- Invited user at any level below
+    depth INT NOT NULL,                              -- Number of invite hops (0 for the self-row)
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_invite_closure_ancestor_depth ON user_invite_closure(ancestor_id, depth);  -- Descendants / subtree sizes
+CREATE INDEX IF NOT EXISTS idx_user_invite_closure_descendant ON user_invite_closure(descendant_id, depth);    -- Ancestor chains
+
+
+-- Client-generated message IDs make sends idempotent: a retried send with the same ID stores nothing new
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS client_msg_id VARCHAR(64);
+ALTER TABLE group_messages ADD COLUMN IF NOT EXISTS client_msg_id VARCHAR(64);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_client_msg_id ON messages(sender_id, client_msg_id) WHERE client_msg_id IS NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_group_messages_client_msg_id ON group_messages(sender_id, client_msg_id) WHERE client_msg_id IS NOT NULL;
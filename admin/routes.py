@@ -0,0 +1,80 @@
+from flask import Blueprint, request, jsonify, Response
+from auth.utils import admin_required
+from utils import profiler
+from database import queries
+
+# Create blueprint
+admin_bp = Blueprint('admin', __name__)
+
+# Longest profiling window an admin can open, in seconds
+MAX_PROFILE_DURATION = 3600
+
+@admin_bp.route('/admin/profiler/start', methods=['POST'])
+@admin_required
+def start_profiler():
+    """Enable sampling profiling for a time window and share of requests"""
+    data = request.json or {}
+    duration = data.get('duration', 60)
+    sample_rate = data.get('sample_rate', 1.0)
+    slow_ms = data.get('slow_ms', profiler.SLOW_REQUEST_MS)
+
+    if not isinstance(duration, (int, float)) or not (0 < duration <= MAX_PROFILE_DURATION):
+        return jsonify({'error': 'Invalid duration'}), 400
+
+    if not isinstance(sample_rate, (int, float)) or not (0 < sample_rate <= 1):
+        return jsonify({'error': 'Invalid sample rate'}), 400
+
+    if not isinstance(slow_ms, (int, float)) or slow_ms < 0:
+        return jsonify({'error': 'Invalid slow request threshold'}), 400
+
+    profiler.start(duration, sample_rate, slow_ms)
+    return jsonify(profiler.status()), 200
+
+@admin_bp.route('/admin/profiler/stop', methods=['POST'])
+@admin_required
+def stop_profiler():
+    """Disable profiling (collected data remains available)"""
+    profiler.stop()
+    return jsonify(profiler.status()), 200
+
+@admin_bp.route('/admin/profiler/status', methods=['GET'])
+@admin_required
+def profiler_status():
+    """Get the profiler state"""
+    return jsonify(profiler.status()), 200
+
+@admin_bp.route('/admin/profiler/collapsed', methods=['GET'])
+@admin_required
+def profiler_collapsed():
+    """Download all samples of the window as collapsed stacks"""
+    return Response(profiler.collapsed_stacks(), mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename=profile.collapsed'})
+
+@admin_bp.route('/admin/profiler/slow', methods=['GET'])
+@admin_required
+def profiler_slow_requests():
+    """Get requests slower than the threshold with their SQL timings and samples"""
+    return jsonify({'captures': profiler.slow_captures()}), 200
+
+@admin_bp.route('/admin/profiler/slow/<int:index>/collapsed', methods=['GET'])
+@admin_required
+def profiler_slow_collapsed(index):
+    """Download the samples of one slow request as collapsed stacks"""
+    if not (0 <= index < len(profiler.slow_captures())):
+        return jsonify({'error': 'Capture not found'}), 404
+
+    return Response(profiler.collapsed_stacks(index), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=slow-{index}.collapsed'})
+
+@admin_bp.route('/admin/queries', methods=['GET'])
+@admin_required
+def query_stats():
+    """Get execution and plan cache statistics of the registered statements"""
+    return jsonify({'statements': queries.stats()}), 200
+
+@admin_bp.route('/admin/queries/reset', methods=['POST'])
+@admin_required
+def reset_query_stats():
+    """Zero the statement statistics"""
+    queries.reset_stats()
+    return jsonify({'statements': queries.stats()}), 200
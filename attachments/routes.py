@@ -0,0 +1,152 @@
+import os
+from flask import Blueprint, request, jsonify, session, send_file
+from attachments.storage import (create_upload, get_upload, append_chunk, finish_upload,
+                                 blob_path, get_thumbnail, safe_mime_type, GENERIC_MIME_TYPE,
+                                 MAX_ATTACHMENT_SIZE, MAX_CHUNK_SIZE)
+from database.attachments import create_attachment_db, get_attachment_for_user
+
+# Create blueprint
+attachments_bp = Blueprint('attachments', __name__)
+
+# Blobs are immutable, so clients may cache downloads for a long time
+BLOB_MAX_AGE = 7 * 24 * 3600
+
+def _get_own_upload(upload_id):
+    """Return upload metadata if it belongs to the current user"""
+    upload = get_upload(upload_id)
+    if not upload or upload['user_id'] != session['user_id']:
+        return None
+    return upload
+
+@attachments_bp.route('/attachments/uploads', methods=['POST'])
+def start_upload():
+    """Start a resumable chunked upload"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    data = request.json
+    filename = os.path.basename(data.get('filename') or '')
+    size = data.get('size')
+    # The declared type is only kept if it is on the allow-list
+    mime_type = safe_mime_type(data.get('mime_type'))
+
+    if not filename or not isinstance(size, int):
+        return jsonify({'error': 'Missing data'}), 400
+
+    if not (0 < size <= MAX_ATTACHMENT_SIZE):
+        return jsonify({'error': 'Invalid file size'}), 400
+
+    upload_id = create_upload(session['user_id'], filename, size, mime_type)
+    return jsonify({
+        'upload_id': upload_id,
+        'offset': 0,
+        'chunk_size': MAX_CHUNK_SIZE
+    }), 201
+
+@attachments_bp.route('/attachments/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Get the number of bytes received so far, used to resume an upload"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    upload = _get_own_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    return jsonify({'offset': upload['offset'], 'size': upload['size']}), 200
+
+@attachments_bp.route('/attachments/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Receive one chunk of an upload at the offset given in the Upload-Offset header"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    upload = _get_own_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    offset = request.headers.get('Upload-Offset', type=int)
+    length = request.content_length
+
+    if offset is None or not length:
+        return jsonify({'error': 'Missing Upload-Offset or Content-Length'}), 400
+
+    # Only allow appending at the current end, so retried chunks stay consistent
+    if offset != upload['offset']:
+        return jsonify({'error': 'Offset mismatch', 'offset': upload['offset']}), 409
+
+    if length > MAX_CHUNK_SIZE or offset + length > upload['size']:
+        return jsonify({'error': 'Chunk too large'}), 413
+
+    new_offset = append_chunk(upload_id, offset, request.stream, length)
+    return jsonify({'offset': new_offset, 'size': upload['size']}), 200
+
+@attachments_bp.route('/attachments/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Finish an upload and register it as an attachment"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    upload = _get_own_upload(upload_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    if upload['offset'] != upload['size']:
+        return jsonify({'error': 'Upload incomplete', 'offset': upload['offset']}), 409
+
+    sha256 = finish_upload(upload_id)
+    attachment_id = create_attachment_db(session['user_id'], sha256, upload['size'],
+                                         upload['mime_type'], upload['filename'])
+    if not attachment_id:
+        return jsonify({'error': 'Failed to save attachment'}), 500
+
+    return jsonify({
+        'attachment_id': attachment_id,
+        'sha256': sha256,
+        'size': upload['size']
+    }), 201
+
+@attachments_bp.route('/attachments/<int:attachment_id>', methods=['GET'])
+def download_attachment(attachment_id):
+    """Download an attachment (supports HTTP range requests)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    attachment = get_attachment_for_user(attachment_id, session['user_id'])
+    if not attachment:
+        return jsonify({'error': 'Attachment not found'}), 404
+
+    # Only allow-listed types are shown inline; everything else (including
+    # rows stored before the allow-list existed) is forced to download
+    mime_type = safe_mime_type(attachment['mime_type'])
+
+    # send_file streams through wsgi.file_wrapper (sendfile on servers that
+    # support it) and answers Range / If-None-Match when conditional=True
+    response = send_file(blob_path(attachment['sha256']),
+                         mimetype=mime_type,
+                         as_attachment=mime_type == GENERIC_MIME_TYPE,
+                         download_name=attachment['filename'],
+                         conditional=True,
+                         etag=attachment['sha256'],
+                         max_age=BLOB_MAX_AGE)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@attachments_bp.route('/attachments/<int:attachment_id>/thumbnail', methods=['GET'])
+def attachment_thumbnail(attachment_id):
+    """Get an image attachment's thumbnail, generating it on first request"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    attachment = get_attachment_for_user(attachment_id, session['user_id'])
+    if not attachment or not attachment['mime_type'].startswith('image/'):
+        return jsonify({'error': 'Thumbnail not found'}), 404
+
+    path = get_thumbnail(attachment['sha256'])
+    if not path:
+        return jsonify({'error': 'Thumbnail unavailable'}), 404
+
+    response = send_file(path, mimetype='image/jpeg', conditional=True,
+                         etag=f"thumb-{attachment['sha256']}", max_age=BLOB_MAX_AGE)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+from config import Config
+
+# Storage layout (all under ATTACHMENTS_DIR):
+#   uploads/<upload_id>.part  - partially received upload
+#   uploads/<upload_id>.json  - upload metadata (owner, name, declared size)
+#   blobs/ab/cd/<sha256>      - content-addressed, deduplicated file contents
+#   thumbs/<sha256>.jpg       - lazily generated image thumbnails
+STORAGE_ROOT = getattr(Config, 'ATTACHMENTS_DIR', os.path.join('storage', 'attachments'))
+MAX_ATTACHMENT_SIZE = getattr(Config, 'ATTACHMENT_MAX_SIZE', 100 * 1024 * 1024)
+MAX_CHUNK_SIZE = getattr(Config, 'ATTACHMENT_MAX_CHUNK_SIZE', 8 * 1024 * 1024)
+THUMBNAIL_SIZE = (320, 320)
+
+# Types that are safe to display inline on our origin; anything else (HTML,
+# SVG, scripts...) is stored as application/octet-stream and only downloaded
+SAFE_MIME_TYPES = frozenset([
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'audio/mpeg', 'audio/ogg', 'audio/wav', 'audio/webm',
+    'video/mp4', 'video/webm', 'video/ogg',
+    'application/pdf', 'text/plain'
+])
+GENERIC_MIME_TYPE = 'application/octet-stream'
+
+# Block size used when streaming request bodies and hashing files
+IO_BLOCK_SIZE = 64 * 1024
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+def _uploads_dir():
+    return os.path.join(STORAGE_ROOT, 'uploads')
+
+def _part_path(upload_id):
+    return os.path.join(_uploads_dir(), f"{upload_id}.part")
+
+def _meta_path(upload_id):
+    return os.path.join(_uploads_dir(), f"{upload_id}.json")
+
+def blob_path(sha256):
+    """Return the content-addressed path of a stored blob"""
+    return os.path.join(STORAGE_ROOT, 'blobs', sha256[:2], sha256[2:4], sha256)
+
+def thumbnail_path(sha256):
+    """Return the path of a blob's cached thumbnail"""
+    return os.path.join(STORAGE_ROOT, 'thumbs', f"{sha256}.jpg")
+
+def safe_mime_type(mime_type):
+    """Return mime_type if it may be served inline, else the generic binary type"""
+    if isinstance(mime_type, str):
+        mime_type = mime_type.split(';', 1)[0].strip().lower()
+        if mime_type in SAFE_MIME_TYPES:
+            return mime_type
+    return GENERIC_MIME_TYPE
+
+def create_upload(user_id, filename, size, mime_type):
+    """Start a new resumable upload and return its ID"""
+    os.makedirs(_uploads_dir(), exist_ok=True)
+    upload_id = secrets.token_hex(16)
+
+    meta = {
+        'user_id': user_id,
+        'filename': filename,
+        'size': size,
+        'mime_type': mime_type
+    }
+    with open(_meta_path(upload_id), 'w') as f:
+        json.dump(meta, f)
+
+    # Create the empty part file so the offset of a new upload is 0
+    open(_part_path(upload_id), 'wb').close()
+    return upload_id
+
+def get_upload(upload_id):
+    """Return upload metadata with the current offset, or None if unknown"""
+    if not _UPLOAD_ID_RE.match(upload_id):
+        return None
+
+    try:
+        with open(_meta_path(upload_id)) as f:
+            meta = json.load(f)
+        meta['offset'] = os.path.getsize(_part_path(upload_id))
+    except (OSError, ValueError):
+        return None
+
+    return meta
+
+def append_chunk(upload_id, offset, stream, length):
+    """Append a chunk read from stream at the given offset and return the new offset"""
+    with open(_part_path(upload_id), 'r+b') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            block = stream.read(min(IO_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            f.write(block)
+            remaining -= len(block)
+
+        # Drop anything past the written range (e.g. a previously aborted chunk)
+        f.truncate()
+        return f.tell()
+
+def finish_upload(upload_id):
+    """Move a completed upload into content-addressed storage and return its SHA-256"""
+    part = _part_path(upload_id)
+
+    digest = hashlib.sha256()
+    with open(part, 'rb') as f:
+        for block in iter(lambda: f.read(IO_BLOCK_SIZE), b''):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+
+    target = blob_path(sha256)
+    if os.path.exists(target):
+        # Identical content is already stored, keep a single copy
+        os.remove(part)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(part, target)
+
+    os.remove(_meta_path(upload_id))
+    return sha256
+
+def get_thumbnail(sha256):
+    """Return the path of a blob's thumbnail, generating it on first use"""
+    path = thumbnail_path(sha256)
+    if os.path.exists(path):
+        return path
+
+    try:
+        from PIL import Image
+    except ImportError:
+        # Pillow is optional, thumbnails are simply unavailable without it
+        return None
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+        with Image.open(blob_path(sha256)) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            image.convert('RGB').save(tmp_path, 'JPEG', quality=85)
+        os.replace(tmp_path, path)
+        return path
+    except Exception as e:
+        print(f"Error generating thumbnail for {sha256}: {e}")
+        return None
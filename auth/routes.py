@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify, session, render_template
-from auth.utils import hash_password, validate_username, validate_password
+from auth.utils import hash_password, validate_username, validate_password, is_admin_name
 from database.users import get_user_by_name, create_user, check_invite_code
 from database.connection import get_db_connection
+from database.invites import record_invite_lineage
 from utils.helpers import generate_invite_hash
 from chat.socket import active_connections
 
@@ -36,6 +37,7 @@ def login():
 
         if user and user[1] == hash_password(password):
             session['user_id'] = user[0]
+            session['is_admin'] = is_admin_name(username)
             return jsonify({
                 'message': 'Login successful',
                 'avatar_id': user[2]
@@ -67,6 +69,7 @@ def register():
         return jsonify({'error': 'Password does not meet requirements'}), 400
 
     conn = get_db_connection()
+    conn.autocommit = False  # user, invite and lineage are written atomically
     cur = conn.cursor()
 
     try:
@@ -113,6 +116,9 @@ def register():
             VALUES (%s, %s, %s)
         """, (inviter_id, new_user_id, invite_code))
 
+        # Record the new user's invite lineage
+        record_invite_lineage(cur, inviter_id, new_user_id)
+
         conn.commit()
         return jsonify({
             'message': 'Registration successful',
@@ -141,8 +147,7 @@ def logout():
                 username = user_result[0]
 
                 # Remove the user from active connections
-                if username in active_connections:
-                    del active_connections[username]
+                active_connections.remove_user(username)
 
         except Exception as e:
             print(f"Error during logout: {e}")
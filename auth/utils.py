@@ -1,5 +1,8 @@
 import hashlib
 import re
+from functools import wraps
+from flask import jsonify, session
+from config import Config
 
 def hash_password(password):
     """Hash a password using SHA-256"""
@@ -11,4 +14,19 @@ def validate_username(username):
 
 def validate_password(password):
     """Validate password strength"""
-    return len(password) >= 8 and re.search(r'[!@#$%^&*(),.?":{}|<>]', password) is not None
\ No newline at end of file
+    return len(password) >= 8 and re.search(r'[!@#$%^&*(),.?":{}|<>]', password) is not None
+
+def is_admin_name(username):
+    """Check whether a username is listed in Config.ADMIN_USERS"""
+    return username in getattr(Config, 'ADMIN_USERS', ())
+
+def admin_required(view):
+    """Restrict a route to logged-in administrators"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not logged in'}), 401
+        if not session.get('is_admin'):
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapped
\ No newline at end of file
@@ -0,0 +1,158 @@
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+class Connection:
+    """Per-socket state, kept small with __slots__ for very many connections"""
+    __slots__ = ('sid', 'username', 'connected_at', 'last_activity', 'options')
+
+    def __init__(self, sid, now):
+        self.sid = sid
+        self.username = None
+        self.connected_at = now
+        self.last_activity = now
+        self.options = None
+
+class ConnectionRegistry:
+    """Active sockets indexed by socket ID and by username, all operations O(1)
+
+    Handlers and the idle sweep run on different threads, so every access
+    to the indexes holds the registry's lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Ordered by last activity, so idle sockets are always at the front
+        self._by_sid = OrderedDict()
+        # username -> sid of the user's most recently authenticated socket
+        self._by_user = {}
+
+    def __len__(self):
+        return len(self._by_sid)
+
+    def __contains__(self, username):
+        return username in self._by_user
+
+    def connect(self, sid, now=None):
+        """Register a newly connected socket"""
+        conn = Connection(sid, now or time.monotonic())
+        with self._lock:
+            self._by_sid[sid] = conn
+        return conn
+
+    def authenticate(self, sid, username, options=None, now=None):
+        """Bind a socket to a user, replacing the user's previous socket"""
+        with self._lock:
+            conn = self._by_sid.get(sid) or self.connect(sid, now)
+
+            # The socket may have been bound to another user before
+            if conn.username and self._by_user.get(conn.username) == sid:
+                del self._by_user[conn.username]
+
+            conn.username = username
+            conn.options = options or None
+            self._by_user[username] = sid
+            self.touch(sid, now)
+        return conn
+
+    def disconnect(self, sid):
+        """Forget a socket and return its record (or None)"""
+        with self._lock:
+            conn = self._by_sid.pop(sid, None)
+            if conn and conn.username and self._by_user.get(conn.username) == sid:
+                del self._by_user[conn.username]
+        return conn
+
+    def remove_user(self, username):
+        """Forget a user's socket mapping (e.g. on logout)"""
+        with self._lock:
+            sid = self._by_user.pop(username, None)
+            if sid:
+                conn = self._by_sid.get(sid)
+                if conn:
+                    conn.username = None
+        return sid
+
+    def get(self, username, default=None):
+        """Return the socket ID of an online user"""
+        return self._by_user.get(username, default)
+
+    def get_connection(self, sid):
+        """Return the record of a socket"""
+        return self._by_sid.get(sid)
+
+    def touch(self, sid, now=None):
+        """Record activity on a socket"""
+        with self._lock:
+            conn = self._by_sid.get(sid)
+            if conn:
+                conn.last_activity = now or time.monotonic()
+                self._by_sid.move_to_end(sid)
+
+    def idle_sids(self, timeout, now=None):
+        """Return the sockets without activity for longer than timeout seconds"""
+        deadline = (now or time.monotonic()) - timeout
+        idle = []
+        with self._lock:
+            for sid, conn in self._by_sid.items():
+                if conn.last_activity > deadline:
+                    break
+                idle.append(sid)
+        return idle
+
+def benchmark(count=100000):
+    """Measure memory per connection and connect/auth/touch/disconnect throughput
+
+    Prints the results and returns them as a dict.
+    """
+    registry = ConnectionRegistry()
+    sids = [f"sid-{i:08d}" for i in range(count)]
+    usernames = [f"user{i}" for i in range(count)]
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for sid in sids:
+        registry.connect(sid)
+    connect_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for sid, username in zip(sids, usernames):
+        registry.authenticate(sid, username)
+    auth_s = time.perf_counter() - started
+    bytes_per_conn = (tracemalloc.get_traced_memory()[0] - baseline) / count
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for sid in sids:
+        registry.touch(sid)
+    touch_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    registry.idle_sids(0)
+    sweep_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for sid in sids:
+        registry.disconnect(sid)
+    disconnect_s = time.perf_counter() - started
+
+    results = {
+        'connections': count,
+        'bytes_per_connection': round(bytes_per_conn),
+        'connect_per_s': round(count / connect_s),
+        'authenticate_per_s': round(count / auth_s),
+        'touch_per_s': round(count / touch_s),
+        'sweep_ms': round(sweep_s * 1000, 1),
+        'disconnect_per_s': round(count / disconnect_s),
+        'left_over': len(registry)
+    }
+    for name, value in results.items():
+        print(f"{name:<22} {value}")
+    return results
+
+if __name__ == '__main__':
+    # Usage: python -m chat.connections [count]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
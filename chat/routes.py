@@ -1,11 +1,22 @@
 from flask import Blueprint, request, jsonify, session, render_template
 from database.users import get_user_by_id, get_user_by_name, update_user_avatar, get_user_invite_codes, delete_user_account
-from database.messages import get_message_history_db, get_user_contacts
+from database.messages import (get_message_history_db, get_message_history_json, get_user_contacts,
+                               store_messages_bulk_db, HISTORY_COLUMNS, MAX_BULK_MESSAGES)
+from database.groups import (create_group_db, add_group_member_db, get_user_groups,
+                             get_group_history_db, mark_group_read_db, DEFAULT_HISTORY_LIMIT)
+from database.invites import (get_invite_ancestors, get_invite_descendants, get_invite_subtree_size,
+                              MAX_DESCENDANTS)
 from database.connection import get_db_connection
+from chat.socket import join_group_room, get_client_msg_id, push_message_batches
+from utils.serialization import raw_json_response
+from config import Config
 
 # Create blueprint
 chat_bp = Blueprint('chat', __name__)
 
+# Let Postgres build history pages as JSON (json_agg) when possible
+HISTORY_JSON_IN_DB = getattr(Config, 'HISTORY_JSON_IN_DB', True)
+
 @chat_bp.route('/chat')
 def chat():
     """Render the chat page"""
@@ -173,11 +184,22 @@ def get_message_history():
     if not other_user:
         return jsonify({'error': 'Missing username'}), 400
 
+    # format=rows answers {"columns": [...], "messages": [[...], ...]}, encoded
+    # straight from the row tuples without building a dict per message
+    columnar = request.args.get('format') == 'rows'
+
+    if HISTORY_JSON_IN_DB and not columnar:
+        messages_json = get_message_history_json(session['user_id'], other_user)
+        if messages_json is not None:
+            return raw_json_response(f'{{"messages":{messages_json}}}'), 200
+
     messages = get_message_history_db(session['user_id'], other_user)
     if messages is None:  # None indicates an error
         return jsonify({'error': 'Failed to get message history'}), 500
 
-    return jsonify({'messages': messages}), 200
+    if columnar:
+        return jsonify({'columns': HISTORY_COLUMNS, 'messages': messages}), 200
+    return jsonify({'messages': [dict(zip(HISTORY_COLUMNS, row)) for row in messages]}), 200
 
 @chat_bp.route('/get-contacts', methods=['GET'])
 def get_contacts():
@@ -189,4 +211,223 @@ def get_contacts():
     if contacts is None:  # None indicates an error
         return jsonify({'error': 'Failed to get contacts'}), 500
 
-    return jsonify({'contacts': contacts}), 200
\ No newline at end of file
+    return jsonify({'contacts': contacts}), 200
+
+@chat_bp.route('/send-messages', methods=['POST'])
+def send_messages():
+    """Send a batch of messages (e.g. bot notifications) without a socket"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    data = request.json or {}
+    items = data.get('messages')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Missing messages'}), 400
+
+    if len(items) > MAX_BULK_MESSAGES:
+        return jsonify({'error': f'At most {MAX_BULK_MESSAGES} messages per request'}), 400
+
+    # Invalid items are reported individually, the rest of the batch is sent
+    results = [None] * len(items)
+    valid_items = []
+    valid_indexes = []
+    for index, item in enumerate(items):
+        if (not isinstance(item, dict) or not isinstance(item.get('to'), str) or
+                not isinstance(item.get('text'), str) or not item['to'] or not item['text']):
+            results[index] = {'status': 'error', 'error': 'Missing data'}
+            continue
+        valid_items.append({
+            'to': item['to'],
+            'text': item['text'],
+            'client_msg_id': get_client_msg_id(item)
+        })
+        valid_indexes.append(index)
+
+    if valid_items:
+        stored = store_messages_bulk_db(session['user_id'], valid_items)
+        if stored is None:
+            return jsonify({'error': 'Failed to store messages'}), 500
+        sender, stored_results = stored
+
+        # Group new messages per recipient so each gets one emit
+        batches = {}
+        for index, item, result in zip(valid_indexes, valid_items, stored_results):
+            results[index] = result
+            if result['status'] == 'ok' and not result['duplicate']:
+                batches.setdefault(item['to'], []).append({
+                    'from': sender,
+                    'to': item['to'],
+                    'text': item['text'],
+                    'id': result['id'],
+                    'timestamp': result['timestamp']
+                })
+        push_message_batches(batches)
+
+    return jsonify({'results': results}), 200
+
+@chat_bp.route('/create-group', methods=['POST'])
+def create_group():
+    """Create a group conversation"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    data = request.json
+    title = (data.get('title') or '').strip()
+    members = data.get('members') or []
+
+    if not title:
+        return jsonify({'error': 'Missing group title'}), 400
+
+    if not isinstance(members, list):
+        return jsonify({'error': 'Invalid member list'}), 400
+
+    group = create_group_db(session['user_id'], title, members)
+    if not group:
+        return jsonify({'error': 'Failed to create group'}), 500
+
+    # Subscribe members that are already online to the group room
+    join_group_room(group['id'], group['members'])
+
+    return jsonify(group), 201
+
+@chat_bp.route('/add-group-member', methods=['POST'])
+def add_group_member():
+    """Add a user to a group conversation"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    data = request.json
+    conversation_id = data.get('conversation_id')
+    username = data.get('username')
+
+    if not all([conversation_id, username]):
+        return jsonify({'error': 'Missing data'}), 400
+
+    if not add_group_member_db(conversation_id, session['user_id'], username):
+        return jsonify({'error': 'Failed to add group member'}), 400
+
+    join_group_room(conversation_id, [username])
+
+    return jsonify({'message': 'Member added successfully'}), 200
+
+@chat_bp.route('/get-groups', methods=['GET'])
+def get_groups():
+    """Get the group conversations of the current user"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    groups = get_user_groups(session['user_id'])
+    if groups is None:  # None indicates an error
+        return jsonify({'error': 'Failed to get groups'}), 500
+
+    return jsonify({'groups': groups}), 200
+
+@chat_bp.route('/get-group-history', methods=['GET'])
+def get_group_history():
+    """Get one page of a group conversation's history"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    conversation_id = request.args.get('conversation_id', type=int)
+    if not conversation_id:
+        return jsonify({'error': 'Missing conversation ID'}), 400
+
+    before_id = request.args.get('before_id', type=int)
+    limit = request.args.get('limit', DEFAULT_HISTORY_LIMIT, type=int)
+
+    history = get_group_history_db(conversation_id, session['user_id'], before_id, limit)
+    if history is None:  # None indicates an error
+        return jsonify({'error': 'Failed to get group history'}), 500
+
+    return jsonify(history), 200
+
+@chat_bp.route('/mark-group-read', methods=['POST'])
+def mark_group_read():
+    """Advance the current user's read cursor in a group"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    data = request.json
+    conversation_id = data.get('conversation_id')
+    message_id = data.get('message_id')
+
+    if not all([conversation_id, message_id]):
+        return jsonify({'error': 'Missing data'}), 400
+
+    last_read = mark_group_read_db(conversation_id, session['user_id'], message_id)
+    if last_read is None:
+        return jsonify({'error': 'Failed to update read cursor'}), 400
+
+    return jsonify({'last_read_message_id': last_read}), 200
+
+def _resolve_tree_user():
+    """Return the user ID an invite-tree request is about, or an error response"""
+    username = request.args.get('username')
+    if not username:
+        return session['user_id'], None
+
+    # Looking at someone else's lineage is reserved for moderators
+    if not session.get('is_admin'):
+        return None, (jsonify({'error': 'Forbidden'}), 403)
+
+    user = get_user_by_name(username)
+    if not user:
+        return None, (jsonify({'error': 'User not found'}), 404)
+    return user['id'], None
+
+@chat_bp.route('/invite-tree/ancestors', methods=['GET'])
+def invite_tree_ancestors():
+    """Get the chain of inviters above a user"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    user_id, error = _resolve_tree_user()
+    if error:
+        return error
+
+    ancestors = get_invite_ancestors(user_id)
+    if ancestors is None:  # None indicates an error
+        return jsonify({'error': 'Failed to get invite ancestors'}), 500
+
+    return jsonify({'ancestors': ancestors}), 200
+
+@chat_bp.route('/invite-tree/descendants', methods=['GET'])
+def invite_tree_descendants():
+    """Get the users invited, directly or indirectly, by a user"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    user_id, error = _resolve_tree_user()
+    if error:
+        return error
+
+    max_depth = request.args.get('max_depth', type=int)
+    limit = request.args.get('limit', MAX_DESCENDANTS, type=int)
+
+    # Next page: pass back the next_after depth and username of the previous one
+    after_depth = request.args.get('after_depth', type=int)
+    after_username = request.args.get('after_username')
+    after = (after_depth, after_username) if after_depth is not None and after_username else None
+
+    page = get_invite_descendants(user_id, max_depth, limit, after)
+    if page is None:  # None indicates an error
+        return jsonify({'error': 'Failed to get invite descendants'}), 500
+
+    return jsonify(page), 200
+
+@chat_bp.route('/invite-tree/subtree-size', methods=['GET'])
+def invite_tree_subtree_size():
+    """Count the users downstream of a user"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    user_id, error = _resolve_tree_user()
+    if error:
+        return error
+
+    size = get_invite_subtree_size(user_id)
+    if size is None:  # None indicates an error
+        return jsonify({'error': 'Failed to get invite subtree size'}), 500
+
+    return jsonify(size), 200
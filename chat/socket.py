@@ -1,54 +1,176 @@
-from flask import request, session
-from flask_socketio import emit
-from database.messages import store_message_db
+import statistics
+import sys
+import time
+from flask import Flask, request, session
+from flask_socketio import SocketIO, emit, join_room
+from config import Config
+from chat.connections import ConnectionRegistry
+from utils.profiler import profile_event
+from database.messages import store_message_durable, drain_spooled_messages
+from database.spool import FSYNC_INTERVAL, flush_spool
+from database.groups import store_group_message_db, get_user_group_ids
+from database.users import get_user_by_id
 
-# Dictionary to track active connections (key: username, value: socket_id)
-active_connections = {}
+# Registry of active connections (indexed by socket ID and by username)
+active_connections = ConnectionRegistry()
+
+# Sockets silent for longer than this (no events, no heartbeats) are evicted
+SOCKET_IDLE_TIMEOUT = getattr(Config, 'SOCKET_IDLE_TIMEOUT', 120)
+SOCKET_SWEEP_INTERVAL = getattr(Config, 'SOCKET_SWEEP_INTERVAL', 30)
+
+# Seconds between attempts to replay messages spooled during a database outage
+SPOOL_DRAIN_INTERVAL = getattr(Config, 'SPOOL_DRAIN_INTERVAL', 2)
+
+# Longest accepted client-generated message ID
+MAX_CLIENT_MSG_ID_LENGTH = 64
+
+def group_room(conversation_id):
+    """Return the Socket.IO room name for a group conversation"""
+    return f"group_{conversation_id}"
+
+def get_client_msg_id(data):
+    """Return the client-generated message ID from an event, if it is valid"""
+    client_msg_id = data.get('client_msg_id')
+    if isinstance(client_msg_id, str) and 0 < len(client_msg_id) <= MAX_CLIENT_MSG_ID_LENGTH:
+        return client_msg_id
+    return None
+
+def join_group_room(conversation_id, usernames):
+    """Subscribe the online sockets of the given users to a group room"""
+    for username in usernames:
+        sid = active_connections.get(username)
+        if sid:
+            join_room(group_room(conversation_id), sid=sid, namespace='/')
+
+def push_message_batches(batches):
+    """Send each online recipient its messages in a single 'message_batch' event
+
+    batches maps recipient usernames to lists of message payloads.
+    """
+    for recipient, messages in batches.items():
+        sid = active_connections.get(recipient)
+        if sid:
+            emit('message_batch', messages, to=sid, namespace='/')
+
+def evict_idle_connections(socketio):
+    """Periodically disconnect sockets that stopped sending events or heartbeats"""
+    while True:
+        socketio.sleep(SOCKET_SWEEP_INTERVAL)
+        # Never let one failed sweep end the eviction task
+        try:
+            for sid in active_connections.idle_sids(SOCKET_IDLE_TIMEOUT):
+                active_connections.disconnect(sid)
+                try:
+                    socketio.server.disconnect(sid, namespace='/')
+                except Exception as e:
+                    print(f"Error evicting idle socket {sid}: {e}")
+                print(f"Evicted idle socket: {sid}")
+        except Exception as e:
+            print(f"Error sweeping idle sockets: {e}")
+
+def drain_message_spool(socketio):
+    """Periodically move spooled messages into the database once it is reachable"""
+    while True:
+        socketio.sleep(SPOOL_DRAIN_INTERVAL)
+        try:
+            drain_spooled_messages()
+        except Exception as e:
+            print(f"Error draining message spool: {e}")
+
+def flush_message_spool(socketio):
+    """fsync recently spooled messages within FSYNC_INTERVAL, even when no more arrive"""
+    while True:
+        socketio.sleep(FSYNC_INTERVAL)
+        try:
+            flush_spool()
+        except Exception as e:
+            print(f"Error flushing message spool: {e}")
 
 def setup_socketio(socketio):
     """Configure Socket.IO event handlers"""
+    socketio.start_background_task(evict_idle_connections, socketio)
+    socketio.start_background_task(drain_message_spool, socketio)
+    socketio.start_background_task(flush_message_spool, socketio)
+
     @socketio.on('connect')
     def handle_connect():
         """Handle client connection"""
+        active_connections.connect(request.sid)
         print(f"Client connected: {request.sid}")
 
     @socketio.on('disconnect')
     def handle_disconnect():
         """Handle client disconnection"""
         print(f"Client disconnected: {request.sid}")
-        
-        # Find and remove the user from active connections
-        for username, sid in list(active_connections.items()):
-            if sid == request.sid:
-                del active_connections[username]
-                print(f"User {username} disconnected from WebSocket")
-                break
+
+        # Remove the socket from active connections (constant time)
+        conn = active_connections.disconnect(request.sid)
+        if conn and conn.username:
+            print(f"User {conn.username} disconnected from WebSocket")
+
+    @socketio.on('heartbeat')
+    def handle_heartbeat():
+        """Keep an otherwise idle socket from being evicted"""
+        active_connections.touch(request.sid)
 
     @socketio.on('auth')
+    @profile_event('auth')
     def handle_auth(data):
         """Handle WebSocket authentication"""
-        username = data.get('username')
-        if not username:
+        # The identity comes from the login session, never from the client
+        user = get_user_by_id(session['user_id']) if 'user_id' in session else None
+        if not user:
             return
+        username = user['name']
 
-        # Save the user's connection with their socket ID
-        active_connections[username] = request.sid
+        # Save the user's connection with their socket ID and protocol options
+        options = data.get('options') if isinstance(data.get('options'), dict) else None
+        active_connections.authenticate(request.sid, username, options)
         print(f"User {username} authenticated via WebSocket: {request.sid}")
 
+        # Subscribe the socket to all of the user's group rooms
+        for conversation_id in get_user_group_ids(user['id']):
+            join_room(group_room(conversation_id))
+
     @socketio.on('message')
+    @profile_event('message')
     def handle_message(data):
-        """Handle message sending"""
-        sender = data.get('from')
+        """Handle message sending; the return value is the client's ack"""
         recipient = data.get('to')
-        text = data.get('text')
+        text = data.get('text') or ''
+        attachment_id = data.get('attachment_id')
+        client_msg_id = get_client_msg_id(data)
+        active_connections.touch(request.sid)
 
-        if not all([sender, recipient, text]):
-            return
+        if 'user_id' not in session:
+            return {'status': 'error', 'error': 'Not logged in'}
+
+        # The sender is the logged-in user, whatever 'from' the client claims;
+        # the name the socket authenticated with saves a lookup per message
+        conn = active_connections.get_connection(request.sid)
+        sender = conn.username if conn else None
+        if not sender:
+            user = get_user_by_id(session['user_id'])
+            if not user:
+                return {'status': 'error', 'error': 'Not logged in'}
+            sender = user['name']
+        data['from'] = sender
+
+        # A message needs text, an attachment, or both
+        if not recipient or not (text or attachment_id):
+            return {'status': 'error', 'error': 'Missing data'}
 
-        # Save the message in the database
-        timestamp = store_message_db(sender, recipient, text)
-        if timestamp:
-            data['timestamp'] = timestamp
+        # Save the message in the database (attachment contents stay in file storage);
+        # during an outage it is spooled to disk and inserted later
+        stored = store_message_durable(sender, recipient, text, attachment_id, client_msg_id)
+        if stored:
+            data['id'] = stored['id']
+            data['timestamp'] = stored['timestamp']
+
+            # A retry of an already stored message was delivered the first time
+            if stored['duplicate']:
+                return {'status': 'ok', 'id': stored['id'],
+                        'timestamp': stored['timestamp'], 'duplicate': True}
 
         # Send the message to the recipient if they are online
         recipient_sid = active_connections.get(recipient)
@@ -56,4 +178,96 @@ def setup_socketio(socketio):
             emit('message', data, room=recipient_sid)
             print(f"Message sent to {recipient} (sid: {recipient_sid})")
         else:
-            print(f"User {recipient} is not online, message stored only")
\ No newline at end of file
+            print(f"User {recipient} is not online, message stored only")
+
+        if not stored:
+            return {'status': 'error', 'error': 'Failed to store message'}
+        if stored.get('queued'):
+            return {'status': 'queued', 'id': None, 'timestamp': stored['timestamp'],
+                    'duplicate': False}
+        return {'status': 'ok', 'id': stored['id'],
+                'timestamp': stored['timestamp'], 'duplicate': False}
+
+    @socketio.on('group_message')
+    @profile_event('group_message')
+    def handle_group_message(data):
+        """Handle sending a message to a group conversation"""
+        conversation_id = data.get('conversation_id')
+        text = data.get('text')
+        active_connections.touch(request.sid)
+
+        if 'user_id' not in session:
+            return {'status': 'error', 'error': 'Not logged in'}
+
+        if not all([conversation_id, text]):
+            return {'status': 'error', 'error': 'Missing data'}
+
+        # Store a single row for the whole group; the sender is the logged-in
+        # user, whatever 'from' the client claims
+        stored = store_group_message_db(conversation_id, session['user_id'], text,
+                                        get_client_msg_id(data))
+        if not stored:
+            return {'status': 'error', 'error': 'Failed to store message'}
+
+        data['from'] = stored['sender']
+        data['id'] = stored['id']
+        data['timestamp'] = stored['timestamp']
+
+        # Fan out to every online member with one room emit (retries were fanned out already)
+        if not stored['duplicate']:
+            emit('group_message', data, room=group_room(conversation_id),
+                 include_self=False)
+
+        return {'status': 'ok', 'id': stored['id'],
+                'timestamp': stored['timestamp'], 'duplicate': stored['duplicate']}
+
+def benchmark_group_fanout(member_counts=(10, 100, 1000), rounds=50):
+    """Measure the server-side cost of delivering one group message to N members
+
+    Uses in-process test clients, so the numbers cover room lookup, encoding
+    and per-socket delivery, not network latency. Prints one line per group
+    size and returns the measurements.
+    """
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='threading')
+
+    @socketio.on('join')
+    def bench_join(conversation_id):
+        join_room(group_room(conversation_id))
+
+    @socketio.on('group_message')
+    def bench_group_message(data):
+        # Same fan-out as handle_group_message
+        emit('group_message', data, room=group_room(data['conversation_id']),
+             include_self=False)
+
+    results = []
+    for conversation_id, members in enumerate(member_counts, 1):
+        clients = [socketio.test_client(app) for _ in range(members + 1)]
+        for client in clients:
+            client.emit('join', conversation_id)
+        sender, receivers = clients[0], clients[1:]
+
+        samples = []
+        for i in range(rounds):
+            payload = {'conversation_id': conversation_id, 'from': 'bench',
+                       'text': f"message {i}", 'id': i}
+            started = time.perf_counter()
+            sender.emit('group_message', payload)
+            samples.append((time.perf_counter() - started) * 1000)
+            for client in receivers:
+                client.get_received()
+
+        median_ms = statistics.median(samples)
+        print(f"{members:>5} members: median {median_ms:8.3f} ms, "
+              f"p95 {sorted(samples)[int(len(samples) * 0.95) - 1]:8.3f} ms, "
+              f"{median_ms * 1000 / members:6.2f} us per member")
+        results.append({'members': members, 'median_ms': median_ms})
+
+        for client in clients:
+            client.disconnect()
+    return results
+
+if __name__ == '__main__':
+    # Usage: python -m chat.socket [rounds]
+    benchmark_group_fanout(rounds=int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,57 @@
+from database.connection import get_db_connection
+
+def create_attachment_db(uploader_id, sha256, size, mime_type, filename):
+    """Store attachment metadata and return the new attachment ID"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            INSERT INTO attachments (uploader_id, sha256, size, mime_type, filename)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id
+        """, (uploader_id, sha256, size, mime_type, filename))
+
+        attachment_id = cur.fetchone()[0]
+        conn.commit()
+        return attachment_id
+    except Exception as e:
+        conn.rollback()
+        print(f"Error creating attachment: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def get_attachment_for_user(attachment_id, user_id):
+    """Get attachment metadata if the user uploaded it or was part of a message using it"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT a.id, a.sha256, a.size, a.mime_type, a.filename
+            FROM attachments a
+            WHERE a.id = %s
+              AND (a.uploader_id = %s OR EXISTS (
+                    SELECT 1 FROM messages m
+                    WHERE m.attachment_id = a.id
+                      AND (m.sender_id = %s OR m.receiver_id = %s)))
+        """, (attachment_id, user_id, user_id, user_id))
+
+        row = cur.fetchone()
+        if row:
+            return {
+                'id': row[0],
+                'sha256': row[1],
+                'size': row[2],
+                'mime_type': row[3],
+                'filename': row[4]
+            }
+        return None
+    except Exception as e:
+        print(f"Error getting attachment: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
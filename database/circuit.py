@@ -0,0 +1,59 @@
+import threading
+import time
+from config import Config
+
+class CircuitBreaker:
+    """Stops calling a failing dependency for a while, then probes it again"""
+
+    # closed: calls go through and consecutive failures are counted
+    # open: calls are refused until reset_timeout has passed
+    # half-open: a single probe call decides whether to close or re-open
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """Return True if a call may be attempted now"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        """Report a successful call"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        """Report a failed (or too slow) call"""
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Database circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+# Breaker guarding message writes to Postgres
+db_breaker = CircuitBreaker(
+    failure_threshold=getattr(Config, 'DB_BREAKER_FAILURES', 3),
+    reset_timeout=getattr(Config, 'DB_BREAKER_RESET_TIMEOUT', 10.0)
+)
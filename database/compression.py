@@ -0,0 +1,294 @@
+import os
+import sys
+import time
+import threading
+import zlib
+from config import Config
+from database.connection import get_db_connection
+from utils.warmup import warmup_hook
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+# Values of the body_format column
+FORMAT_PLAIN = 0
+FORMAT_ZLIB = 1
+FORMAT_ZSTD = 2
+FORMAT_ZSTD_DICT = 3
+
+# Bodies shorter than this (in bytes) are stored verbatim
+COMPRESSION_THRESHOLD = getattr(Config, 'MESSAGE_COMPRESSION_THRESHOLD', 1024)
+# Preferred codec, 'zstd' falls back to 'zlib' when zstandard is missing
+COMPRESSION_CODEC = getattr(Config, 'MESSAGE_COMPRESSION_CODEC', 'zstd')
+COMPRESSION_LEVEL = getattr(Config, 'MESSAGE_COMPRESSION_LEVEL', 6)
+# Optional shared zstd dictionary trained on our message corpus, used for new rows
+ZSTD_DICT_PATH = getattr(Config, 'MESSAGE_ZSTD_DICT', None)
+# Every dictionary ever used is kept here as <dict_id>.dict; rows are decoded
+# with the dictionary named in their zstd frame, so retraining is safe
+ZSTD_DICT_DIR = getattr(Config, 'MESSAGE_ZSTD_DICT_DIR', os.path.join('storage', 'zstd-dicts'))
+
+# Tables whose bodies may be compressed
+COMPRESSED_TABLES = ('messages', 'group_messages')
+
+_local = threading.local()
+_dict_lock = threading.Lock()
+# dict_id -> ZstdCompressionDict
+_dictionaries = {}
+_active_dict_id = None
+
+def _load_dictionary(path):
+    """Load a dictionary file and register it under its dict_id"""
+    with open(path, 'rb') as f:
+        dictionary = zstandard.ZstdCompressionDict(f.read())
+    _dictionaries[dictionary.dict_id()] = dictionary
+    return dictionary
+
+def _scan_dictionaries():
+    """Register every dictionary kept in ZSTD_DICT_DIR"""
+    if os.path.isdir(ZSTD_DICT_DIR):
+        for name in os.listdir(ZSTD_DICT_DIR):
+            if name.endswith('.dict'):
+                _load_dictionary(os.path.join(ZSTD_DICT_DIR, name))
+
+def _archive_dictionary(dictionary):
+    """Store a dictionary in ZSTD_DICT_DIR under its dict_id, if it is not there yet"""
+    path = os.path.join(ZSTD_DICT_DIR, f"{dictionary.dict_id()}.dict")
+    if not os.path.exists(path):
+        os.makedirs(ZSTD_DICT_DIR, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(dictionary.as_bytes())
+    return path
+
+def _get_zstd_dict():
+    """Return the dictionary new rows are compressed with, or None if not configured"""
+    global _active_dict_id
+    if not ZSTD_DICT_PATH or not zstandard:
+        return None
+    if _active_dict_id is None:
+        with _dict_lock:
+            if _active_dict_id is None:
+                _scan_dictionaries()
+                dictionary = _load_dictionary(ZSTD_DICT_PATH)
+                # Keep a copy, rows written now stay readable after a retrain
+                _archive_dictionary(dictionary)
+                _active_dict_id = dictionary.dict_id()
+    return _dictionaries[_active_dict_id]
+
+def _get_dictionary(dict_id):
+    """Return the dictionary with the given dict_id"""
+    dictionary = _dictionaries.get(dict_id)
+    if dictionary is None:
+        with _dict_lock:
+            # A dictionary trained after startup may have appeared since
+            _scan_dictionaries()
+            dictionary = _dictionaries.get(dict_id)
+        if dictionary is None:
+            raise RuntimeError(f"zstd dictionary {dict_id} not found in {ZSTD_DICT_DIR}")
+    return dictionary
+
+@warmup_hook
+def load_compression_dictionary(app):
+    """Load the zstd dictionaries before the first large message arrives"""
+    _get_zstd_dict()
+
+def _zstd_compressor():
+    """Return this thread's zstd compressor (compressors are not thread-safe)"""
+    if not hasattr(_local, 'compressor'):
+        dict_data = _get_zstd_dict()
+        # The frame records the dictionary's ID (write_dict_id) so reads can find it
+        _local.compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dict_data,
+                                                     write_dict_id=True)
+        _local.compressor_format = FORMAT_ZSTD_DICT if dict_data else FORMAT_ZSTD
+    return _local.compressor, _local.compressor_format
+
+def _zstd_decompressor(body_format, body_blob):
+    """Return this thread's zstd decompressor for a stored body"""
+    dict_id = 0
+    if body_format == FORMAT_ZSTD_DICT:
+        dict_id = zstandard.get_frame_parameters(body_blob).dict_id
+    attr = f"decompressor_{dict_id}"
+    if not hasattr(_local, attr):
+        dict_data = _get_dictionary(dict_id) if dict_id else None
+        setattr(_local, attr, zstandard.ZstdDecompressor(dict_data=dict_data))
+    return getattr(_local, attr)
+
+def encode_body(text):
+    """Prepare a message body for storage, returning (content, body_format, body_blob)"""
+    raw = text.encode('utf-8')
+    if len(raw) < COMPRESSION_THRESHOLD:
+        return text, FORMAT_PLAIN, None
+
+    if COMPRESSION_CODEC == 'zstd' and zstandard:
+        compressor, body_format = _zstd_compressor()
+        compressed = compressor.compress(raw)
+    else:
+        body_format = FORMAT_ZLIB
+        compressed = zlib.compress(raw, COMPRESSION_LEVEL)
+
+    # Incompressible bodies are not worth the decompression cost
+    if len(compressed) >= len(raw):
+        return text, FORMAT_PLAIN, None
+
+    return '', body_format, compressed
+
+def decode_body(content, body_format, body_blob):
+    """Return the original message text from its stored representation"""
+    if body_format == FORMAT_PLAIN:
+        return content
+
+    if body_format == FORMAT_ZLIB:
+        return zlib.decompress(body_blob).decode('utf-8')
+
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to read zstd-compressed messages")
+    return _zstd_decompressor(body_format, body_blob).decompress(body_blob).decode('utf-8')
+
+def recompress_messages(table='messages', batch_size=500):
+    """Compress existing plain rows above the threshold, returning (rows, bytes saved)"""
+    if table not in COMPRESSED_TABLES:
+        raise ValueError(f"Unknown table: {table}")
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    last_id = 0
+    total_rows = 0
+    bytes_saved = 0
+
+    try:
+        while True:
+            # Walk the table in id order so each batch is a short transaction
+            cur.execute(f"""
+                SELECT id, content
+                FROM {table}
+                WHERE id > %s AND body_format = %s
+                  AND octet_length(content) >= %s
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, FORMAT_PLAIN, COMPRESSION_THRESHOLD, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            last_id = rows[-1][0]
+            updates = []
+            for message_id, content in rows:
+                new_content, body_format, body_blob = encode_body(content)
+                if body_format != FORMAT_PLAIN:
+                    updates.append((new_content, body_format, body_blob, message_id))
+                    bytes_saved += len(content.encode('utf-8')) - len(body_blob)
+
+            if updates:
+                # Only touch rows still stored plain, in case they changed meanwhile
+                cur.executemany(f"""
+                    UPDATE {table}
+                    SET content = %s, body_format = %s, body_blob = %s
+                    WHERE id = %s AND body_format = {FORMAT_PLAIN}
+                """, updates)
+                total_rows += len(updates)
+
+        print(f"Recompressed {total_rows} rows in {table}, saved {bytes_saved} bytes")
+        return total_rows, bytes_saved
+    finally:
+        cur.close()
+        conn.close()
+
+def _sample_bodies(limit):
+    """Return the most recent plain message bodies, encoded as UTF-8"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT content
+            FROM messages
+            WHERE body_format = %s AND content <> ''
+            ORDER BY id DESC
+            LIMIT %s
+        """, (FORMAT_PLAIN, limit))
+        return [row[0].encode('utf-8') for row in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+def train_dictionary(output_path, dict_size=112640, sample_limit=10000):
+    """Train a zstd dictionary from a sample of stored message bodies
+
+    The dictionary is also archived in ZSTD_DICT_DIR, so pointing
+    MESSAGE_ZSTD_DICT at it later keeps older rows readable.
+    """
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to train a dictionary")
+
+    samples = _sample_bodies(sample_limit)
+    dictionary = zstandard.train_dictionary(dict_size, samples)
+    with open(output_path, 'wb') as f:
+        f.write(dictionary.as_bytes())
+    _archive_dictionary(dictionary)
+    print(f"Trained {len(dictionary.as_bytes())}-byte dictionary {dictionary.dict_id()} "
+          f"from {len(samples)} messages")
+
+def benchmark(samples=None, sample_limit=10000):
+    """Compare bytes saved and encode/decode CPU time of each codec
+
+    samples defaults to recent message bodies from the database. Only bodies
+    above COMPRESSION_THRESHOLD are measured, as only those get compressed.
+    Prints one line per codec and returns the measurements.
+    """
+    if samples is None:
+        samples = _sample_bodies(sample_limit)
+    samples = [body for body in samples if len(body) >= COMPRESSION_THRESHOLD]
+    if not samples:
+        print(f"No message bodies of at least {COMPRESSION_THRESHOLD} bytes to measure")
+        return []
+
+    codecs = {'zlib': (lambda raw: zlib.compress(raw, COMPRESSION_LEVEL), zlib.decompress)}
+    if zstandard:
+        compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+        decompressor = zstandard.ZstdDecompressor()
+        codecs['zstd'] = (compressor.compress, decompressor.decompress)
+        if len(samples) >= 10:
+            # Trained on every other body, measured on all of them
+            dictionary = zstandard.train_dictionary(112640, samples[::2])
+            dict_compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+            dict_decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+            codecs['zstd-dict'] = (dict_compressor.compress, dict_decompressor.decompress)
+
+    raw_bytes = sum(len(body) for body in samples)
+    print(f"{len(samples)} bodies, {raw_bytes} bytes")
+    results = []
+    for name, (compress, decompress) in codecs.items():
+        started = time.process_time()
+        blobs = [compress(body) for body in samples]
+        encode_us = (time.process_time() - started) * 1e6 / len(samples)
+
+        started = time.process_time()
+        for blob in blobs:
+            decompress(blob)
+        decode_us = (time.process_time() - started) * 1e6 / len(samples)
+
+        # Incompressible bodies are stored plain, as encode_body does
+        stored_bytes = sum(min(len(blob), len(body)) for blob, body in zip(blobs, samples))
+        print(f"{name:<10} saved {raw_bytes - stored_bytes:>10} bytes "
+              f"({(1 - stored_bytes / raw_bytes) * 100:5.1f}%)   "
+              f"write {encode_us:8.1f} us/msg   read {decode_us:8.1f} us/msg")
+        results.append({'codec': name, 'bytes_saved': raw_bytes - stored_bytes,
+                        'encode_us': encode_us, 'decode_us': decode_us})
+    return results
+
+if __name__ == '__main__':
+    # Usage: python -m database.compression recompress | train <output_path>
+    #        | benchmark [samples_file]   (one message body per line)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'recompress'
+    if command == 'train':
+        train_dictionary(sys.argv[2])
+    elif command == 'benchmark':
+        if len(sys.argv) > 2:
+            with open(sys.argv[2], 'rb') as f:
+                benchmark([line.rstrip(b'\n') for line in f])
+        else:
+            benchmark()
+    else:
+        for table_name in COMPRESSED_TABLES:
+            recompress_messages(table_name)
@@ -1,63 +1,347 @@
-import psycopg2
+import os
+import threading
+import time
+from psycopg2 import errors, extensions, pool
 from config import Config
+from utils import profiler
+from utils.warmup import warmup_hook
 
-def get_db_connection():
-    """Create and return a database connection"""
-    conn = psycopg2.connect(
-        host=Config.DB_HOST,
-        port=Config.DB_PORT,
-        dbname=Config.DB_NAME,
-        user=Config.DB_USER,
-        password=Config.DB_PASSWORD
-    )
-    conn.autocommit = True
-    return conn
+# Bump whenever init_db() gains new DDL, so workers re-run it exactly once
+SCHEMA_VERSION = 7
+# Advisory lock key serializing schema migrations between workers
+SCHEMA_LOCK_ID = 7263001
+
+# Idle connections kept open per worker, and the hard upper limit
+DB_POOL_SIZE = getattr(Config, 'DB_POOL_SIZE', 5)
+DB_POOL_MAX = getattr(Config, 'DB_POOL_MAX', 20)
+# Seconds a caller waits for a free connection once DB_POOL_MAX are in use
+DB_POOL_TIMEOUT = getattr(Config, 'DB_POOL_TIMEOUT', 2)
+# Seconds to wait for Postgres to accept a connection before giving up (libpq
+# rounds anything lower up to 2). Together with DB_POOL_TIMEOUT this stays
+# under the client's 5 second message ack timeout, so a send is answered
+# before the client retries it
+DB_CONNECT_TIMEOUT = getattr(Config, 'DB_CONNECT_TIMEOUT', 2)
+
+_pool = None
+# Counts connections handed out, so no more than DB_POOL_MAX exist at once
+_pool_slots = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+class PooledConnection:
+    """Connection proxy whose close() hands the connection back to the pool"""
+
+    def __init__(self, conn_pool, slots, conn):
+        self._pool = conn_pool
+        self._slots = slots
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        # Settings such as autocommit belong to the real connection
+        if name in ('_pool', '_slots', '_conn'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def close(self):
+        """Return the connection to the pool (broken connections are discarded)"""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        except pool.PoolError:
+            # The pool was replaced (e.g. after a fork), just drop the connection
+            conn.close()
+        finally:
+            self._slots.release()
+
+class PreparingConnection(extensions.connection):
+    """Connection remembering which registered statements it has prepared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Prepared statements live as long as the server session (see database.queries)
+        self.prepared_statements = set()
+
+class ProfiledCursor(extensions.cursor):
+    """Cursor that reports query timings to the profiler for sampled requests"""
+
+    def execute(self, query, vars=None):
+        profile = profiler.current_profile()
+        if profile is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            profile.add_sql(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        profile = profiler.current_profile()
+        if profile is None:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            profile.add_sql(query, time.perf_counter() - started)
+
+def _connection_params():
+    """Return the keyword arguments used to open database connections"""
+    return {
+        'host': Config.DB_HOST,
+        'port': Config.DB_PORT,
+        'dbname': Config.DB_NAME,
+        'user': Config.DB_USER,
+        'password': Config.DB_PASSWORD,
+        'connect_timeout': DB_CONNECT_TIMEOUT,
+        'connection_factory': PreparingConnection,
+        'cursor_factory': ProfiledCursor
+    }
+
+def _get_pool():
+    """Return this process's connection pool, creating it on first use"""
+    global _pool, _pool_slots, _pool_pid
+    # Connections must never be shared across forked workers
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = pool.ThreadedConnectionPool(DB_POOL_SIZE, DB_POOL_MAX,
+                                                    **_connection_params())
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _pool_pid = os.getpid()
+    return _pool, _pool_slots
+
+def get_db_connection(timeout=None):
+    """Return a pooled database connection; close() gives it back to the pool
+
+    Waits up to timeout (default DB_POOL_TIMEOUT) seconds when all
+    DB_POOL_MAX connections are in use, then raises PoolError instead of
+    opening more.
+    """
+    conn_pool, slots = _get_pool()
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT if timeout is None else timeout):
+        raise pool.PoolError("connection pool exhausted")
+
+    try:
+        conn = conn_pool.getconn()
+        if conn.closed:
+            conn_pool.putconn(conn, close=True)
+            conn = conn_pool.getconn()
+        conn.autocommit = True
+    except Exception:
+        slots.release()
+        raise
+    return PooledConnection(conn_pool, slots, conn)
+
+@warmup_hook
+def prefill_pool(app):
+    """Open the pool's idle connections before the first request needs them"""
+    _get_pool()
+
+def _get_schema_version(cur):
+    """Return the applied schema version, or None on a fresh database"""
+    try:
+        cur.execute("SELECT MAX(version) FROM schema_version")
+        return cur.fetchone()[0]
+    except errors.UndefinedTable:
+        return None
 
 def init_db():
-    """Initialize database tables if they don't exist"""
+    """Initialize database tables unless the schema is already up to date"""
     conn = get_db_connection()
     cur = conn.cursor()
-    
-    try:
-        # Create user_data table
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS user_data (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL UNIQUE,
-                password_hash VARCHAR(64) NOT NULL,
-                avatar_id INTEGER NOT NULL DEFAULT 1,
-                hash_for_invite_first VARCHAR(64) NOT NULL,
-                hash_for_invite_second VARCHAR(64) NOT NULL,
-                hash_for_invite_first_used BOOLEAN NOT NULL DEFAULT FALSE,
-                hash_for_invite_second_used BOOLEAN NOT NULL DEFAULT FALSE
-            );
-        ''')
 
-        # Create messages table
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id SERIAL PRIMARY KEY,
-                sender_id INTEGER NOT NULL REFERENCES user_data(id),
-                receiver_id INTEGER NOT NULL REFERENCES user_data(id),
-                content TEXT NOT NULL,
-                timestamp TIMESTAMP NOT NULL DEFAULT NOW()
-            );
-        ''')
+    try:
+        # Fast path: a single SELECT when another worker already migrated
+        if _get_schema_version(cur) == SCHEMA_VERSION:
+            print("Database schema is up to date")
+            return
 
-        # Create user_invites table
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS user_invites (
-                id SERIAL PRIMARY KEY,
-                inviter_id INTEGER NOT NULL REFERENCES user_data(id),
-                invitee_id INTEGER NOT NULL REFERENCES user_data(id),
-                invite_hash VARCHAR(64) NOT NULL,
-                timestamp TIMESTAMP NOT NULL DEFAULT NOW()
-            );
-        ''')
-        
-        print("Database initialized successfully")
+        cur.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_ID,))
+        try:
+            if _get_schema_version(cur) != SCHEMA_VERSION:
+                _create_tables(cur)
+                print("Database initialized successfully")
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_ID,))
     except Exception as e:
         print(f"Error initializing database: {e}")
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def _create_tables(cur):
+    """Create or migrate all tables and record the schema version"""
+    # Create user_data table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_data (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL UNIQUE,
+            password_hash VARCHAR(64) NOT NULL,
+            avatar_id INTEGER NOT NULL DEFAULT 1,
+            hash_for_invite_first VARCHAR(64) NOT NULL,
+            hash_for_invite_second VARCHAR(64) NOT NULL,
+            hash_for_invite_first_used BOOLEAN NOT NULL DEFAULT FALSE,
+            hash_for_invite_second_used BOOLEAN NOT NULL DEFAULT FALSE
+        );
+    ''')
+
+    # Create messages table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id SERIAL PRIMARY KEY,
+            sender_id INTEGER NOT NULL REFERENCES user_data(id),
+            receiver_id INTEGER NOT NULL REFERENCES user_data(id),
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    ''')
+
+    # Create user_invites table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_invites (
+            id SERIAL PRIMARY KEY,
+            inviter_id INTEGER NOT NULL REFERENCES user_data(id),
+            invitee_id INTEGER NOT NULL REFERENCES user_data(id),
+            invite_hash VARCHAR(64) NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    ''')
+
+    # Create attachments table (file contents live in content-addressed storage)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS attachments (
+            id SERIAL PRIMARY KEY,
+            uploader_id INTEGER NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,
+            sha256 CHAR(64) NOT NULL,
+            size BIGINT NOT NULL,
+            mime_type VARCHAR(255) NOT NULL,
+            filename VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    ''')
+    cur.execute('''
+        ALTER TABLE messages
+        ADD COLUMN IF NOT EXISTS attachment_id INTEGER
+        REFERENCES attachments(id) ON DELETE SET NULL;
+    ''')
+    # Downloads by a recipient check for a message referencing the attachment
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_attachment
+        ON messages(attachment_id)
+        WHERE attachment_id IS NOT NULL;
+    ''')
+
+    # Create conversations table (group chats)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            id SERIAL PRIMARY KEY,
+            title VARCHAR(255) NOT NULL,
+            created_by INTEGER REFERENCES user_data(id) ON DELETE SET NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    ''')
+
+    # Create conversation_members table with per-member read cursors
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_members (
+            conversation_id INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,
+            last_read_message_id INTEGER NOT NULL DEFAULT 0,
+            joined_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (conversation_id, user_id)
+        );
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_conversation_members_user
+        ON conversation_members(user_id);
+    ''')
+
+    # Create group_messages table (one row per group post)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS group_messages (
+            id SERIAL PRIMARY KEY,
+            conversation_id INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+            sender_id INTEGER NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_group_messages_conversation
+        ON group_messages(conversation_id, id);
+    ''')
+
+    # Large bodies may be stored compressed in body_blob (see database.compression)
+    for table in ('messages', 'group_messages'):
+        cur.execute(f'''
+            ALTER TABLE {table}
+            ADD COLUMN IF NOT EXISTS body_format SMALLINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS body_blob BYTEA;
+        ''')
+
+    # Client-generated message IDs make sends idempotent per sender
+    for table in ('messages', 'group_messages'):
+        cur.execute(f'''
+            ALTER TABLE {table}
+            ADD COLUMN IF NOT EXISTS client_msg_id VARCHAR(64);
+        ''')
+        cur.execute(f'''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_client_msg_id
+            ON {table}(sender_id, client_msg_id)
+            WHERE client_msg_id IS NOT NULL;
+        ''')
+
+    # Create the invite lineage closure table (one row per ancestor/descendant pair)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_invite_closure (
+            ancestor_id INTEGER NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,
+            descendant_id INTEGER NOT NULL REFERENCES user_data(id) ON DELETE CASCADE,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        );
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_invite_closure_ancestor_depth
+        ON user_invite_closure(ancestor_id, depth);
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_invite_closure_descendant
+        ON user_invite_closure(descendant_id, depth);
+    ''')
+
+    # Backfill the closure from existing invites (no-op once populated)
+    cur.execute('''
+        INSERT INTO user_invite_closure (ancestor_id, descendant_id, depth)
+        SELECT id, id, 0 FROM user_data
+        ON CONFLICT DO NOTHING;
+    ''')
+    cur.execute('''
+        WITH RECURSIVE lineage (ancestor_id, descendant_id, depth) AS (
+            SELECT inviter_id, invitee_id, 1
+            FROM user_invites
+            UNION
+            SELECT l.ancestor_id, ui.invitee_id, l.depth + 1
+            FROM lineage l
+            JOIN user_invites ui ON ui.inviter_id = l.descendant_id
+        )
+        INSERT INTO user_invite_closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth)
+        FROM lineage
+        GROUP BY ancestor_id, descendant_id
+        ON CONFLICT DO NOTHING;
+    ''')
+
+    # Record the schema version so later startups skip the DDL
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER NOT NULL
+        );
+    ''')
+    cur.execute("DELETE FROM schema_version")
+    cur.execute("INSERT INTO schema_version (version) VALUES (%s)", (SCHEMA_VERSION,))
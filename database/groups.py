@@ -0,0 +1,241 @@
+from database.connection import get_db_connection
+from database.compression import encode_body, decode_body
+
+# Page size limits for group history requests
+DEFAULT_HISTORY_LIMIT = 50
+MAX_HISTORY_LIMIT = 200
+
+def create_group_db(creator_id, title, member_names):
+    """Create a group conversation and return its ID and member names"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            INSERT INTO conversations (title, created_by)
+            VALUES (%s, %s)
+            RETURNING id
+        """, (title, creator_id))
+        conversation_id = cur.fetchone()[0]
+
+        # Add the creator and all requested members in a single statement
+        cur.execute("""
+            INSERT INTO conversation_members (conversation_id, user_id)
+            SELECT %s, id
+            FROM user_data
+            WHERE id = %s OR name = ANY(%s)
+            ON CONFLICT DO NOTHING
+            RETURNING (SELECT name FROM user_data WHERE id = user_id)
+        """, (conversation_id, creator_id, list(member_names)))
+        members = [row[0] for row in cur.fetchall()]
+
+        conn.commit()
+        return {'id': conversation_id, 'title': title, 'members': members}
+    except Exception as e:
+        conn.rollback()
+        print(f"Error creating group: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def add_group_member_db(conversation_id, requester_id, username):
+    """Add a user to a group the requester belongs to"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            INSERT INTO conversation_members (conversation_id, user_id)
+            SELECT cm.conversation_id, ud.id
+            FROM conversation_members cm, user_data ud
+            WHERE cm.conversation_id = %s AND cm.user_id = %s AND ud.name = %s
+            ON CONFLICT DO NOTHING
+            RETURNING user_id
+        """, (conversation_id, requester_id, username))
+
+        result = cur.fetchone()
+        conn.commit()
+        return result is not None
+    except Exception as e:
+        conn.rollback()
+        print(f"Error adding group member: {e}")
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+def get_user_groups(user_id):
+    """Get the groups a user belongs to with unread message counts"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT c.id, c.title, cm.last_read_message_id,
+                   (SELECT COUNT(*)
+                    FROM group_messages gm
+                    WHERE gm.conversation_id = c.id
+                      AND gm.id > cm.last_read_message_id) AS unread
+            FROM conversation_members cm
+            JOIN conversations c ON c.id = cm.conversation_id
+            WHERE cm.user_id = %s
+            ORDER BY c.id
+        """, (user_id,))
+
+        return [{
+            'id': row[0],
+            'title': row[1],
+            'last_read_message_id': row[2],
+            'unread': row[3]
+        } for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error getting user groups: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def get_user_group_ids(user_id):
+    """Get the IDs of all groups a user belongs to"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT conversation_id
+            FROM conversation_members
+            WHERE user_id = %s
+        """, (user_id,))
+        return [row[0] for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error getting group IDs: {e}")
+        return []
+    finally:
+        cur.close()
+        conn.close()
+
+def store_group_message_db(conversation_id, sender_id, text, client_msg_id=None):
+    """Store one message for a group and return its ID, timestamp and sender name"""
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        content, body_format, body_blob = encode_body(text)
+
+        # Insert only if the sender is a member of the group; a repeated
+        # client_msg_id inserts nothing
+        cur.execute("""
+            INSERT INTO group_messages
+            (conversation_id, sender_id, content, body_format, body_blob, client_msg_id, timestamp)
+            SELECT cm.conversation_id, cm.user_id, %s, %s, %s, %s, NOW()
+            FROM conversation_members cm
+            WHERE cm.user_id = %s AND cm.conversation_id = %s
+            ON CONFLICT (sender_id, client_msg_id) WHERE client_msg_id IS NOT NULL
+            DO NOTHING
+            RETURNING id, timestamp, (SELECT name FROM user_data WHERE id = sender_id)
+        """, (content, body_format, body_blob, client_msg_id, sender_id, conversation_id))
+
+        result = cur.fetchone()
+        duplicate = False
+        if not result and client_msg_id:
+            # Retried send: answer with the row stored by the first attempt
+            cur.execute("""
+                SELECT gm.id, gm.timestamp, ud.name
+                FROM group_messages gm
+                JOIN user_data ud ON ud.id = gm.sender_id
+                WHERE gm.sender_id = %s AND gm.client_msg_id = %s
+                  AND gm.conversation_id = %s
+            """, (sender_id, client_msg_id, conversation_id))
+            result = cur.fetchone()
+            duplicate = result is not None
+
+        if not result:
+            print(f"User {sender_id} is not a member of group {conversation_id}")
+            return None
+
+        message_id, timestamp, sender = result
+        conn.commit()
+        return {'id': message_id, 'timestamp': timestamp.isoformat(), 'sender': sender,
+                'duplicate': duplicate}
+
+    except Exception as e:
+        print(f"Error storing group message: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+def get_group_history_db(conversation_id, user_id, before_id=None, limit=DEFAULT_HISTORY_LIMIT):
+    """Get one page of group history, newest page first, messages in ascending order"""
+    limit = max(1, min(limit, MAX_HISTORY_LIMIT))
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        # Fetch one extra row to know whether older messages exist
+        cur.execute("""
+            SELECT gm.id, ud.name, gm.content, gm.body_format, gm.body_blob, gm.timestamp
+            FROM group_messages gm
+            JOIN conversation_members cm
+              ON cm.conversation_id = gm.conversation_id AND cm.user_id = %s
+            JOIN user_data ud ON ud.id = gm.sender_id
+            WHERE gm.conversation_id = %s
+              AND (%s IS NULL OR gm.id < %s)
+            ORDER BY gm.id DESC
+            LIMIT %s
+        """, (user_id, conversation_id, before_id, before_id, limit + 1))
+
+        rows = cur.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+
+        messages = []
+        for message_id, sender, content, body_format, body_blob, timestamp in rows:
+            messages.append({
+                'id': message_id,
+                'conversation_id': conversation_id,
+                'from': sender,
+                'text': decode_body(content, body_format, body_blob),
+                'timestamp': timestamp
+            })
+
+        return {'messages': messages, 'has_more': has_more}
+
+    except Exception as e:
+        print(f"Error getting group history: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def mark_group_read_db(conversation_id, user_id, message_id):
+    """Advance a member's read cursor (never moves it backwards)"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            UPDATE conversation_members
+            SET last_read_message_id = GREATEST(last_read_message_id, %s)
+            WHERE conversation_id = %s AND user_id = %s
+            RETURNING last_read_message_id
+        """, (message_id, conversation_id, user_id))
+
+        result = cur.fetchone()
+        conn.commit()
+        return result[0] if result else None
+    except Exception as e:
+        conn.rollback()
+        print(f"Error updating read cursor: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
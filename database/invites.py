@@ -0,0 +1,253 @@
+import io
+import random
+import sys
+import time
+from database.connection import get_db_connection
+
+# Upper bound on the number of users returned by a descendants query
+MAX_DESCENDANTS = 1000
+
+_ANCESTORS_SQL = """
+    SELECT ud.name, ud.avatar_id, c.depth
+    FROM user_invite_closure c
+    JOIN user_data ud ON ud.id = c.ancestor_id
+    WHERE c.descendant_id = %s AND c.depth > 0
+    ORDER BY c.depth
+"""
+
+# Keyset pagination on (depth, name), matching the sort order
+_DESCENDANTS_SQL = """
+    SELECT ud.name, ud.avatar_id, c.depth
+    FROM user_invite_closure c
+    JOIN user_data ud ON ud.id = c.descendant_id
+    WHERE c.ancestor_id = %s AND c.depth > 0
+      AND (%s IS NULL OR c.depth <= %s)
+      AND (%s IS NULL OR (c.depth, ud.name) > (%s, %s))
+    ORDER BY c.depth, ud.name
+    LIMIT %s
+"""
+
+_SUBTREE_SIZE_SQL = """
+    SELECT depth, COUNT(*)
+    FROM user_invite_closure
+    WHERE ancestor_id = %s AND depth > 0
+    GROUP BY depth
+    ORDER BY depth
+"""
+
+def record_invite_lineage(cur, inviter_id, invitee_id):
+    """Add closure rows for a new invitee (run inside the registration transaction)"""
+    # Users created by hand have no closure rows yet, give the inviter its self-row
+    cur.execute("""
+        INSERT INTO user_invite_closure (ancestor_id, descendant_id, depth)
+        VALUES (%s, %s, 0)
+        ON CONFLICT DO NOTHING
+    """, (inviter_id, inviter_id))
+
+    # The invitee descends from every ancestor of the inviter (and from itself)
+    cur.execute("""
+        INSERT INTO user_invite_closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, %s, depth + 1
+        FROM user_invite_closure
+        WHERE descendant_id = %s
+        UNION ALL
+        SELECT %s, %s, 0
+    """, (invitee_id, inviter_id, invitee_id, invitee_id))
+
+def remove_invite_lineage(cur, user_id):
+    """Remove every path through a user being deleted (its subtree becomes detached)"""
+    cur.execute("""
+        DELETE FROM user_invite_closure
+        WHERE descendant_id IN (SELECT descendant_id FROM user_invite_closure
+                                WHERE ancestor_id = %s)
+          AND ancestor_id IN (SELECT ancestor_id FROM user_invite_closure
+                              WHERE descendant_id = %s)
+    """, (user_id, user_id))
+
+def get_invite_ancestors(user_id):
+    """Get the chain of inviters above a user, nearest first"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(_ANCESTORS_SQL, (user_id,))
+
+        return [{
+            'username': row[0],
+            'avatar_id': row[1],
+            'depth': row[2]
+        } for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error getting invite ancestors: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def get_invite_descendants(user_id, max_depth=None, limit=MAX_DESCENDANTS, after=None):
+    """Get one page of the users downstream of a user, closest levels first
+
+    after is the (depth, username) of the last user of the previous page.
+    truncated tells whether more users follow; next_after is then the
+    cursor for the next page.
+    """
+    limit = max(1, min(limit, MAX_DESCENDANTS))
+    after_depth, after_name = after if after else (None, None)
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        # One extra row tells whether the page is complete
+        cur.execute(_DESCENDANTS_SQL, (user_id, max_depth, max_depth,
+                                       after_depth, after_depth, after_name, limit + 1))
+        rows = cur.fetchall()
+        truncated = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            'descendants': [{
+                'username': row[0],
+                'avatar_id': row[1],
+                'depth': row[2]
+            } for row in rows],
+            'truncated': truncated,
+            'next_after': {'depth': rows[-1][2], 'username': rows[-1][0]} if truncated else None
+        }
+    except Exception as e:
+        print(f"Error getting invite descendants: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def get_invite_subtree_size(user_id):
+    """Count the users downstream of a user, in total and per depth"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute(_SUBTREE_SIZE_SQL, (user_id,))
+
+        by_depth = {depth: count for depth, count in cur.fetchall()}
+        return {
+            'total': sum(by_depth.values()),
+            'by_depth': by_depth
+        }
+    except Exception as e:
+        print(f"Error getting invite subtree size: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def benchmark(users=10000, depth=200, lookups=200):
+    """Time the closure-table queries against a recursive walk of user_invites
+
+    Builds a synthetic invite tree of the given size and depth in temporary
+    tables (they shadow the real ones for this session only, nothing is
+    written to the real tables), then times ancestors, descendants and
+    subtree size for random users. Prints one line per query.
+    """
+    # Level sizes: the first user is the root, the rest is spread over depth levels
+    parents = [None]
+    level = [0]
+    per_level = max(1, (users - 1) // depth)
+    while len(parents) < users:
+        next_level = []
+        for _ in range(min(per_level, users - len(parents))):
+            next_level.append(len(parents))
+            parents.append(random.choice(level))
+        level = next_level
+
+    conn = get_db_connection()
+    conn.autocommit = False  # temporary tables are dropped on rollback
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            CREATE TEMP TABLE user_data (id INTEGER PRIMARY KEY, name VARCHAR(255), avatar_id INTEGER)
+                ON COMMIT DROP;
+            CREATE TEMP TABLE user_invites (inviter_id INTEGER, invitee_id INTEGER)
+                ON COMMIT DROP;
+            CREATE TEMP TABLE user_invite_closure (
+                ancestor_id INTEGER, descendant_id INTEGER, depth INTEGER,
+                PRIMARY KEY (ancestor_id, descendant_id)) ON COMMIT DROP;
+        """)
+
+        user_rows = io.StringIO()
+        invite_rows = io.StringIO()
+        closure_rows = io.StringIO()
+        ancestors = [[]]
+        for user_id, parent in enumerate(parents):
+            user_rows.write(f"{user_id}\tuser{user_id}\t1\n")
+            if parent is not None:
+                invite_rows.write(f"{parent}\t{user_id}\n")
+                ancestors.append([parent] + ancestors[parent])
+            closure_rows.write(f"{user_id}\t{user_id}\t0\n")
+            for distance, ancestor in enumerate(ancestors[user_id], 1):
+                closure_rows.write(f"{ancestor}\t{user_id}\t{distance}\n")
+
+        for table, rows in (('user_data', user_rows), ('user_invites', invite_rows),
+                            ('user_invite_closure', closure_rows)):
+            rows.seek(0)
+            cur.copy_from(rows, table)
+        cur.execute("""
+            CREATE INDEX ON user_invites (invitee_id);
+            CREATE INDEX ON user_invites (inviter_id);
+            CREATE INDEX ON user_invite_closure (descendant_id, depth);
+            ANALYZE user_data; ANALYZE user_invites; ANALYZE user_invite_closure;
+        """)
+        print(f"{users} users, depth {max(len(a) for a in ancestors)}, "
+              f"{sum(len(a) + 1 for a in ancestors)} closure rows")
+
+        recursive_ancestors = """
+            WITH RECURSIVE chain AS (
+                SELECT inviter_id, 1 AS depth FROM user_invites WHERE invitee_id = %s
+                UNION ALL
+                SELECT i.inviter_id, chain.depth + 1
+                FROM user_invites i JOIN chain ON i.invitee_id = chain.inviter_id
+            )
+            SELECT ud.name, ud.avatar_id, chain.depth
+            FROM chain JOIN user_data ud ON ud.id = chain.inviter_id
+            ORDER BY chain.depth
+        """
+        recursive_subtree_size = """
+            WITH RECURSIVE tree AS (
+                SELECT invitee_id, 1 AS depth FROM user_invites WHERE inviter_id = %s
+                UNION ALL
+                SELECT i.invitee_id, tree.depth + 1
+                FROM user_invites i JOIN tree ON i.inviter_id = tree.invitee_id
+            )
+            SELECT depth, COUNT(*) FROM tree GROUP BY depth ORDER BY depth
+        """
+        # Deep users for ancestor lookups, shallow ones for subtree lookups
+        deep_users = random.sample(range(users // 2, users), min(lookups, users // 2))
+        shallow_users = [0] + random.sample(range(1, min(users, per_level * 3)),
+                                            min(lookups - 1, per_level * 3 - 1))
+        cases = [
+            ('ancestors (closure)', _ANCESTORS_SQL, deep_users, lambda u: (u,)),
+            ('ancestors (recursive)', recursive_ancestors, deep_users, lambda u: (u,)),
+            ('descendants page (closure)', _DESCENDANTS_SQL, shallow_users,
+             lambda u: (u, None, None, None, None, None, MAX_DESCENDANTS + 1)),
+            ('subtree size (closure)', _SUBTREE_SIZE_SQL, shallow_users, lambda u: (u,)),
+            ('subtree size (recursive)', recursive_subtree_size, shallow_users, lambda u: (u,)),
+        ]
+
+        results = []
+        for name, sql, sample, params in cases:
+            started = time.perf_counter()
+            for user_id in sample:
+                cur.execute(sql, params(user_id))
+                cur.fetchall()
+            avg_ms = (time.perf_counter() - started) * 1000 / len(sample)
+            print(f"{name:<28} {avg_ms:8.3f} ms")
+            results.append({'query': name, 'avg_ms': avg_ms})
+        return results
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+if __name__ == '__main__':
+    # Usage: python -m database.invites [users] [depth]
+    benchmark(*(int(arg) for arg in sys.argv[1:3]))
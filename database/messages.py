@@ -1,63 +1,332 @@
+import datetime
+import time
+import uuid
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import execute_values
+from config import Config
 from database.connection import get_db_connection
+from database import queries
+from database.compression import encode_body, decode_body
+from database.circuit import db_breaker
+from database.spool import get_spool, pending_spools
 
-def store_message_db(sender, recipient, text):
-    """Store a message in the database and return timestamp"""
-    conn = None
-    cur = None
+# Inserts slower than this (ms) count as failures for the circuit breaker
+MESSAGE_DB_LATENCY_BUDGET_MS = getattr(Config, 'MESSAGE_DB_LATENCY_BUDGET_MS', 1000)
+
+# Keys of the message history rows returned by get_message_history_db
+HISTORY_COLUMNS = ('from', 'to', 'text', 'timestamp', 'attachment_id')
+
+# Largest batch accepted by the bulk send endpoint
+MAX_BULK_MESSAGES = getattr(Config, 'BULK_SEND_MAX_ITEMS', 1000)
+
+# Error for a bulk item whose client_msg_id already names a different message
+CLIENT_MSG_ID_REUSED = 'client_msg_id reused for a different message'
+
+def _insert_message(sender, recipient, text, attachment_id=None, client_msg_id=None,
+                    timestamp=None):
+    """Insert a message, raising on database errors (None means it was rejected)
+
+    timestamp (ISO 8601 with a UTC offset) is set when replaying a spooled
+    message, so it keeps the time it was originally sent at. Waiting for a connection and every statement
+    are bounded by MESSAGE_DB_LATENCY_BUDGET_MS, so a hung database raises
+    (QueryCanceled is an OperationalError) instead of blocking the sender.
+    """
+    conn = get_db_connection(timeout=MESSAGE_DB_LATENCY_BUDGET_MS / 1000)
+    cur = conn.cursor()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        cur.execute("SET statement_timeout = %s", (MESSAGE_DB_LATENCY_BUDGET_MS,))
 
         # Get user IDs
-        cur.execute("SELECT id FROM user_data WHERE name = %s", (sender,))
+        queries.execute(cur, queries.USER_ID_BY_NAME, (sender,))
         sender_result = cur.fetchone()
         if not sender_result:
             print(f"Sender {sender} not found")
             return None
         sender_id = sender_result[0]
 
-        cur.execute("SELECT id FROM user_data WHERE name = %s", (recipient,))
+        queries.execute(cur, queries.USER_ID_BY_NAME, (recipient,))
         recipient_result = cur.fetchone()
         if not recipient_result:
             print(f"Recipient {recipient} not found")
             return None
         recipient_id = recipient_result[0]
 
-        # Save the message and return timestamp
-        cur.execute("""
-            INSERT INTO messages (sender_id, receiver_id, content, timestamp)
-            VALUES (%s, %s, %s, NOW())
-            RETURNING timestamp
-        """, (sender_id, recipient_id, text))
+        # Large bodies are compressed before they reach the table
+        content, body_format, body_blob = encode_body(text)
+
+        # Save the message; an attachment may only be referenced by the user
+        # who uploaded it, and a repeated client_msg_id inserts nothing
+        queries.execute(cur, queries.MESSAGE_INSERT,
+                        (sender_id, recipient_id, content, body_format, body_blob,
+                         attachment_id, client_msg_id, timestamp))
+
+        result = cur.fetchone()
+        duplicate = False
+        if not result and client_msg_id:
+            # Retried send: answer with the row stored by the first attempt
+            queries.execute(cur, queries.MESSAGE_BY_CLIENT_ID, (sender_id, client_msg_id))
+            result = cur.fetchone()
+            duplicate = result is not None
 
-        timestamp = cur.fetchone()[0]
+        if not result:
+            print(f"Attachment {attachment_id} not owned by {sender}")
+            return None
+
+        message_id, stored_at = result
         conn.commit()
-        print(f"Message stored in database: {sender} -> {recipient}")
-        return timestamp.isoformat()
+        if not duplicate:
+            print(f"Message stored in database: {sender} -> {recipient}")
+        return {
+            'id': message_id,
+            'timestamp': stored_at.isoformat(),
+            'duplicate': duplicate
+        }
 
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            # The connection goes back to the pool, other callers get no timeout
+            cur.execute("RESET statement_timeout")
+        except psycopg2.Error:
+            pass  # A broken connection is discarded by the pool anyway
+        cur.close()
+        conn.close()
+
+def store_message_db(sender, recipient, text, attachment_id=None, client_msg_id=None):
+    """Store a message and return its ID, timestamp and whether it was a retried duplicate"""
+    try:
+        return _insert_message(sender, recipient, text, attachment_id, client_msg_id)
     except Exception as e:
         print(f"Error storing message: {e}")
-        if conn:
-            conn.rollback()
         return None
+
+def store_message_durable(sender, recipient, text, attachment_id=None, client_msg_id=None):
+    """Store a message, spooling it to local disk when the database is unavailable
+
+    A spooled message is answered with queued=True and no ID; the drainer
+    inserts it once the database is back.
+    """
+    if db_breaker.allow():
+        started = time.monotonic()
+        try:
+            result = _insert_message(sender, recipient, text, attachment_id, client_msg_id)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError) as e:
+            print(f"Error storing message, spooling it: {e}")
+            db_breaker.record_failure()
+        except Exception as e:
+            # Not an availability problem, spooling would not help
+            print(f"Error storing message: {e}")
+            db_breaker.record_success()
+            return None
+        else:
+            # A database that answers too slowly counts against the breaker
+            # as well, but the message made it in
+            if (time.monotonic() - started) * 1000 > MESSAGE_DB_LATENCY_BUDGET_MS:
+                db_breaker.record_failure()
+            else:
+                db_breaker.record_success()
+            return result
+
+    # UTC with an explicit offset: the replay stores it in the database's
+    # time zone, next to the rows stamped by NOW()
+    sent_at = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        get_spool().append({
+            'sender': sender,
+            'recipient': recipient,
+            'text': text,
+            'attachment_id': attachment_id,
+            # The ID makes a replay idempotent even if it is interrupted midway
+            'client_msg_id': client_msg_id or f"spool-{uuid.uuid4()}",
+            'timestamp': sent_at.isoformat()
+        })
+    except OSError as e:
+        print(f"Error spooling message: {e}")
+        return None
+    return {
+        'id': None,
+        'timestamp': sent_at.isoformat(),
+        'duplicate': False,
+        'queued': True
+    }
+
+def drain_spooled_messages():
+    """Insert spooled messages in order until the spools are empty or the database fails
+
+    Drains this worker's spool and any orphaned slot (see pending_spools).
+    Returns the number of messages taken off the spools.
+    """
+    spools = pending_spools()
+    if not spools:
+        return 0
+    if not db_breaker.allow():
+        return 0
+    # Outside the closed state allow() handed this drain the half-open probe,
+    # which must be released whatever happens to the replay
+    took_probe = db_breaker.state != 'closed'
+    reported = False
+    paused = False
+
+    def replay(record):
+        nonlocal reported, paused
+        try:
+            _insert_message(record['sender'], record['recipient'], record['text'],
+                            record['attachment_id'], record['client_msg_id'],
+                            record['timestamp'])
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError) as e:
+            print(f"Database still unavailable, pausing spool replay: {e}")
+            reported = paused = True
+            db_breaker.record_failure()
+            return False
+        except Exception as e:
+            # Retrying cannot fix this record, keep the rest of the spool moving
+            print(f"Dropping spooled message {record['client_msg_id']}: {e}")
+        reported = True
+        db_breaker.record_success()
+        return True
+
+    failed = True
+    drained = 0
+    try:
+        for spool in spools:
+            drained += spool.replay(replay)
+            if paused:
+                break
+        failed = False
     finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        if took_probe and not reported:
+            if failed:
+                db_breaker.record_failure()
+            else:
+                # Nothing was handed to the database, give the probe back
+                db_breaker.record_success()
+    if drained:
+        print(f"Replayed {drained} spooled messages")
+    return drained
 
-def get_message_history_db(user_id, other_username):
-    """Get message history between current user and another user"""
+def store_messages_bulk_db(sender_id, items):
+    """Store a batch of messages from one sender with a single multi-row INSERT
+
+    items are dicts with 'to', 'text' and an optional 'client_msg_id'.
+    Returns the sender's name and one result per item, in item order, or
+    None on error.
+    """
     conn = get_db_connection()
     cur = conn.cursor()
 
     try:
-        # Get current user's name
-        cur.execute("SELECT name FROM user_data WHERE id = %s", (user_id,))
-        current_user = cur.fetchone()[0]
+        queries.execute(cur, queries.USER_NAME_BY_ID, (sender_id,))
+        sender_result = cur.fetchone()
+        if not sender_result:
+            print(f"Sender {sender_id} not found")
+            return None
+        sender = sender_result[0]
+
+        # Resolve every recipient in one round trip
+        cur.execute("SELECT name, id FROM user_data WHERE name = ANY(%s)",
+                    (list({item['to'] for item in items}),))
+        recipient_ids = dict(cur.fetchall())
+
+        # Every row gets a client_msg_id, so RETURNING rows can be matched
+        # back to items (and a retried batch is deduplicated item by item)
+        results = [None] * len(items)
+        pending = {}  # client_msg_id -> indexes of the items using it
+        messages = {}  # client_msg_id -> (recipient ID, text) it was first used for
+        rows = []
+        for index, item in enumerate(items):
+            recipient_id = recipient_ids.get(item['to'])
+            if recipient_id is None:
+                results[index] = {'status': 'error', 'error': 'Recipient not found'}
+                continue
+
+            client_msg_id = item.get('client_msg_id') or f"bulk-{uuid.uuid4()}"
+            if client_msg_id in pending:
+                # Only an identical message is a duplicate
+                if messages[client_msg_id] != (recipient_id, item['text']):
+                    results[index] = {'status': 'error', 'error': CLIENT_MSG_ID_REUSED}
+                else:
+                    pending[client_msg_id].append(index)
+                continue
+            pending[client_msg_id] = [index]
+            messages[client_msg_id] = (recipient_id, item['text'])
 
+            # Large bodies are compressed before they reach the table
+            content, body_format, body_blob = encode_body(item['text'])
+            rows.append((sender_id, recipient_id, content, body_format, body_blob, client_msg_id))
+
+        stored = {}
+        if rows:
+            inserted = execute_values(cur, """
+                INSERT INTO messages
+                (sender_id, receiver_id, content, body_format, body_blob, client_msg_id)
+                VALUES %s
+                ON CONFLICT (sender_id, client_msg_id) WHERE client_msg_id IS NOT NULL
+                DO NOTHING
+                RETURNING client_msg_id, id, timestamp
+            """, rows, page_size=len(rows), fetch=True)
+            for client_msg_id, message_id, timestamp in inserted:
+                stored[client_msg_id] = (message_id, timestamp, False)
+
+            # Items already stored by an earlier attempt answer with that row,
+            # provided it holds the same message
+            retried = [client_msg_id for client_msg_id in pending if client_msg_id not in stored]
+            if retried:
+                cur.execute("""
+                    SELECT client_msg_id, id, timestamp, receiver_id,
+                           content, body_format, body_blob
+                    FROM messages
+                    WHERE sender_id = %s AND client_msg_id = ANY(%s)
+                """, (sender_id, retried))
+                for (client_msg_id, message_id, timestamp, receiver_id,
+                     content, body_format, body_blob) in cur.fetchall():
+                    if (receiver_id, decode_body(content, body_format, body_blob)) \
+                            != messages[client_msg_id]:
+                        stored[client_msg_id] = None
+                        continue
+                    stored[client_msg_id] = (message_id, timestamp, True)
+
+        for client_msg_id, indexes in pending.items():
+            if stored[client_msg_id] is None:
+                for index in indexes:
+                    results[index] = {'status': 'error', 'error': CLIENT_MSG_ID_REUSED}
+                continue
+            message_id, timestamp, duplicate = stored[client_msg_id]
+            for position, index in enumerate(indexes):
+                results[index] = {
+                    'status': 'ok',
+                    'id': message_id,
+                    'timestamp': timestamp.isoformat(),
+                    # Repeats within the batch are duplicates of the first one
+                    'duplicate': duplicate or position > 0
+                }
+
+        conn.commit()
+        print(f"Stored {len(inserted) if rows else 0} bulk messages from {sender}")
+        return sender, results
+
+    except Exception as e:
+        print(f"Error storing bulk messages: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+def get_message_history_db(user_id, other_username):
+    """Get message history between current user and another user
+
+    Rows are (from, to, text, timestamp, attachment_id) tuples, in
+    HISTORY_COLUMNS order, ready to be encoded as JSON arrays.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
         # Get other user's ID
-        cur.execute("SELECT id FROM user_data WHERE name = %s", (other_username,))
+        queries.execute(cur, queries.USER_ID_BY_NAME, (other_username,))
         other_user_id_result = cur.fetchone()
 
         if not other_user_id_result:
@@ -66,28 +335,14 @@ def get_message_history_db(user_id, other_username):
         other_user_id = other_user_id_result[0]
 
         # Get message history
-        cur.execute("""
-            SELECT u_sender.name AS sender_name, u_receiver.name AS receiver_name, 
-                   m.content, m.timestamp
-            FROM messages m
-            JOIN user_data u_sender ON m.sender_id = u_sender.id
-            JOIN user_data u_receiver ON m.receiver_id = u_receiver.id
-            WHERE (m.sender_id = %s AND m.receiver_id = %s) OR 
-                  (m.sender_id = %s AND m.receiver_id = %s)
-            ORDER BY m.timestamp ASC
-        """, (user_id, other_user_id, other_user_id, user_id))
-
-        messages = []
-        for row in cur.fetchall():
-            sender, receiver, text, timestamp = row
-            messages.append({
-                'from': sender,
-                'to': receiver,
-                'text': text,
-                'timestamp': timestamp.isoformat()
-            })
+        queries.execute(cur, queries.MESSAGE_HISTORY, (user_id, other_user_id))
 
-        return messages
+        # Timestamps stay datetimes, the JSON encoder formats them
+        return [
+            (sender, receiver, decode_body(content, body_format, body_blob), timestamp, attachment_id)
+            for sender, receiver, content, body_format, body_blob, timestamp, attachment_id
+            in cur.fetchall()
+        ]
 
     except Exception as e:
         print(f"Error getting message history: {e}")
@@ -96,6 +351,49 @@ def get_message_history_db(user_id, other_username):
         cur.close()
         conn.close()
 
+def get_message_history_json(user_id, other_username):
+    """Get message history as a JSON array built by Postgres (None means fall back)"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        # Postgres cannot decode compressed bodies; the cheap EXISTS probe
+        # runs first and the page is only aggregated when none are present
+        cur.execute("""
+            WITH other AS (SELECT id FROM user_data WHERE name = %s)
+            SELECT CASE
+                WHEN EXISTS (
+                    SELECT 1
+                    FROM messages m
+                    JOIN other ON (m.sender_id = %s AND m.receiver_id = other.id) OR
+                                  (m.sender_id = other.id AND m.receiver_id = %s)
+                    WHERE m.body_format <> 0)
+                THEN NULL
+                ELSE (
+                    SELECT COALESCE(json_agg(json_build_object(
+                               'from', u_sender.name,
+                               'to', u_receiver.name,
+                               'text', m.content,
+                               'timestamp', m.timestamp,
+                               'attachment_id', m.attachment_id
+                           ) ORDER BY m.timestamp)::text, '[]')
+                    FROM messages m
+                    JOIN other ON (m.sender_id = %s AND m.receiver_id = other.id) OR
+                                  (m.sender_id = other.id AND m.receiver_id = %s)
+                    JOIN user_data u_sender ON m.sender_id = u_sender.id
+                    JOIN user_data u_receiver ON m.receiver_id = u_receiver.id)
+            END
+        """, (other_username, user_id, user_id, user_id, user_id))
+
+        return cur.fetchone()[0]
+
+    except Exception as e:
+        print(f"Error getting message history JSON: {e}")
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
 def get_user_contacts(user_id):
     """Get the list of users the current user has communicated with"""
     conn = get_db_connection()
@@ -103,28 +401,11 @@ def get_user_contacts(user_id):
 
     try:
         # Find the current user's name
-        cur.execute("SELECT name FROM user_data WHERE id = %s", (user_id,))
+        queries.execute(cur, queries.USER_NAME_BY_ID, (user_id,))
         current_username = cur.fetchone()[0]
 
         # Find all users the current user has communicated with
-        cur.execute("""
-            SELECT DISTINCT 
-                CASE 
-                    WHEN m.sender_id = %s THEN ud.name
-                    ELSE ud_sender.name
-                END AS contact_name,
-                CASE 
-                    WHEN m.sender_id = %s THEN ud.avatar_id
-                    ELSE ud_sender.avatar_id
-                END AS contact_avatar_id,
-                MAX(m.timestamp) as last_message_time
-            FROM messages m
-            JOIN user_data ud ON m.receiver_id = ud.id
-            JOIN user_data ud_sender ON m.sender_id = ud_sender.id
-            WHERE m.sender_id = %s OR m.receiver_id = %s
-            GROUP BY contact_name, contact_avatar_id
-            ORDER BY last_message_time DESC
-        """, (user_id, user_id, user_id, user_id))
+        queries.execute(cur, queries.USER_CONTACTS, (user_id,))
 
         contacts = []
         for row in cur.fetchall():
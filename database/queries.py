@@ -0,0 +1,239 @@
+import re
+import sys
+import threading
+import time
+from psycopg2 import errors
+
+# Registered statements, by name
+_statements = {}
+_stats_lock = threading.Lock()
+
+class Statement:
+    """A DAO statement that is parsed and planned once per pooled connection"""
+    __slots__ = ('name', 'sql', 'param_types', 'prepare_sql', 'execute_sql', 'plain_sql',
+                 'executions', 'prepares', 'unprepared', 'total_time')
+
+    def __init__(self, name, param_types, sql):
+        self.name = name
+        self.sql = sql
+        self.param_types = param_types
+        self.prepare_sql = (f"PREPARE {name} ({', '.join(param_types)}) AS {sql}"
+                            if param_types else f"PREPARE {name} AS {sql}")
+        self.execute_sql = (f"EXECUTE {name} ({', '.join(['%s'] * len(param_types))})"
+                            if param_types else f"EXECUTE {name}")
+        # The same statement with psycopg2 placeholders, for connections that
+        # cannot prepare it right now (see execute)
+        self.plain_sql = re.sub(r'\$(\d+)', r'%(p\1)s', sql.replace('%', '%%'))
+        self.executions = 0
+        self.prepares = 0
+        self.unprepared = 0
+        self.total_time = 0.0
+
+    def plain_params(self, params):
+        return {f"p{i}": value for i, value in enumerate(params, 1)}
+
+def register(name, param_types, sql):
+    """Declare a statement; parameters are written $1, $2, ... and may repeat"""
+    if name in _statements:
+        raise ValueError(f"Statement {name} is already registered")
+    _statements[name] = Statement(name, param_types, sql)
+    return name
+
+def execute(cur, name, params=()):
+    """Run a registered statement on cur, preparing it on the connection on first use
+
+    Inside an explicit transaction a statement that is not prepared yet runs
+    as plain SQL, so a failed PREPARE can never abort the caller's work.
+    """
+    statement = _statements[name]
+    conn = cur.connection
+    prepared = getattr(conn, 'prepared_statements', None)
+    started = time.perf_counter()
+
+    if prepared is None or (name not in prepared and not conn.autocommit):
+        cur.execute(statement.plain_sql, statement.plain_params(params))
+        _record(statement, started, unprepared=True)
+        return cur
+
+    if name not in prepared:
+        cur.execute(statement.prepare_sql)
+        prepared.add(name)
+        _record(statement, started, prepared=True)
+
+    try:
+        cur.execute(statement.execute_sql, params)
+    except errors.InvalidSqlStatementName:
+        # The server session lost its prepared statements (e.g. DISCARD ALL)
+        prepared.clear()
+        if not conn.autocommit:
+            raise
+        cur.execute(statement.prepare_sql)
+        prepared.add(name)
+        cur.execute(statement.execute_sql, params)
+    _record(statement, started)
+    return cur
+
+def _record(statement, started, prepared=False, unprepared=False):
+    elapsed = time.perf_counter() - started
+    with _stats_lock:
+        if prepared:
+            statement.prepares += 1
+            return
+        statement.executions += 1
+        statement.total_time += elapsed
+        if unprepared:
+            statement.unprepared += 1
+
+def stats():
+    """Return per-statement execution counts, plan cache hits and average latency"""
+    result = []
+    for statement in _statements.values():
+        executions = statement.executions
+        result.append({
+            'name': statement.name,
+            'executions': executions,
+            'prepares': statement.prepares,
+            'unprepared_executions': statement.unprepared,
+            # Executions that reused a plan prepared earlier on the same connection
+            'plan_cache_hits': max(0, executions - statement.prepares - statement.unprepared),
+            'avg_ms': round(statement.total_time * 1000 / executions, 3) if executions else 0.0
+        })
+    return result
+
+def reset_stats():
+    """Zero the counters of every statement"""
+    with _stats_lock:
+        for statement in _statements.values():
+            statement.executions = 0
+            statement.prepares = 0
+            statement.unprepared = 0
+            statement.total_time = 0.0
+
+# Hot statements of database/users.py and database/messages.py
+
+USER_ID_BY_NAME = register('user_id_by_name', ['varchar'], """
+    SELECT id FROM user_data WHERE name = $1
+""")
+
+USER_NAME_BY_ID = register('user_name_by_id', ['integer'], """
+    SELECT name FROM user_data WHERE id = $1
+""")
+
+USER_BY_ID = register('user_by_id', ['integer'], """
+    SELECT id, name, avatar_id
+    FROM user_data
+    WHERE id = $1
+""")
+
+USER_BY_NAME = register('user_by_name', ['varchar'], """
+    SELECT id, name, avatar_id, password_hash
+    FROM user_data
+    WHERE name = $1
+""")
+
+# An attachment may only be referenced by the user who uploaded it, and a
+# repeated client_msg_id inserts nothing. An explicit send time carries its
+# UTC offset and, like NOW(), is stored in the database session's time zone
+MESSAGE_INSERT = register('message_insert', [
+    'integer', 'integer', 'text', 'smallint', 'bytea', 'integer', 'varchar', 'timestamptz'
+], """
+    INSERT INTO messages
+    (sender_id, receiver_id, content, body_format, body_blob, attachment_id,
+     client_msg_id, timestamp)
+    SELECT $1, $2, $3, $4, $5, $6, $7, COALESCE($8, NOW())
+    WHERE $6 IS NULL OR EXISTS (
+        SELECT 1 FROM attachments WHERE id = $6 AND uploader_id = $1)
+    ON CONFLICT (sender_id, client_msg_id) WHERE client_msg_id IS NOT NULL
+    DO NOTHING
+    RETURNING id, timestamp
+""")
+
+MESSAGE_BY_CLIENT_ID = register('message_by_client_id', ['integer', 'varchar'], """
+    SELECT id, timestamp
+    FROM messages
+    WHERE sender_id = $1 AND client_msg_id = $2
+""")
+
+MESSAGE_HISTORY = register('message_history', ['integer', 'integer'], """
+    SELECT u_sender.name AS sender_name, u_receiver.name AS receiver_name,
+           m.content, m.body_format, m.body_blob, m.timestamp, m.attachment_id
+    FROM messages m
+    JOIN user_data u_sender ON m.sender_id = u_sender.id
+    JOIN user_data u_receiver ON m.receiver_id = u_receiver.id
+    WHERE (m.sender_id = $1 AND m.receiver_id = $2) OR
+          (m.sender_id = $2 AND m.receiver_id = $1)
+    ORDER BY m.timestamp ASC
+""")
+
+USER_CONTACTS = register('user_contacts', ['integer'], """
+    SELECT DISTINCT
+        CASE
+            WHEN m.sender_id = $1 THEN ud.name
+            ELSE ud_sender.name
+        END AS contact_name,
+        CASE
+            WHEN m.sender_id = $1 THEN ud.avatar_id
+            ELSE ud_sender.avatar_id
+        END AS contact_avatar_id,
+        MAX(m.timestamp) as last_message_time
+    FROM messages m
+    JOIN user_data ud ON m.receiver_id = ud.id
+    JOIN user_data ud_sender ON m.sender_id = ud_sender.id
+    WHERE m.sender_id = $1 OR m.receiver_id = $1
+    GROUP BY contact_name, contact_avatar_id
+    ORDER BY last_message_time DESC
+""")
+
+def benchmark(iterations=2000):
+    """Compare plain and prepared latency of the hot read statements
+
+    Uses the two oldest users as sample parameters; prints one line per
+    statement and returns the measurements.
+    """
+    from database.connection import get_db_connection
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id, name FROM user_data ORDER BY id LIMIT 2")
+        users = cur.fetchall()
+        if len(users) < 2:
+            print("Benchmark needs at least two users")
+            return []
+        (user_id, username), (other_id, _) = users
+
+        samples = {
+            USER_ID_BY_NAME: (username,),
+            USER_BY_ID: (user_id,),
+            MESSAGE_HISTORY: (user_id, other_id),
+            USER_CONTACTS: (user_id,)
+        }
+
+        results = []
+        for name, params in samples.items():
+            statement = _statements[name]
+
+            started = time.perf_counter()
+            for _ in range(iterations):
+                cur.execute(statement.plain_sql, statement.plain_params(params))
+                cur.fetchall()
+            plain_ms = (time.perf_counter() - started) * 1000 / iterations
+
+            execute(cur, name, params)  # prepare outside the timed loop
+            started = time.perf_counter()
+            for _ in range(iterations):
+                execute(cur, name, params)
+                cur.fetchall()
+            prepared_ms = (time.perf_counter() - started) * 1000 / iterations
+
+            print(f"{name:<24} plain {plain_ms:8.3f} ms   prepared {prepared_ms:8.3f} ms   "
+                  f"({(1 - prepared_ms / plain_ms) * 100:5.1f}% faster)")
+            results.append({'name': name, 'plain_ms': plain_ms, 'prepared_ms': prepared_ms})
+        return results
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == '__main__':
+    # Usage: python -m database.queries [iterations]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,282 @@
+import fcntl
+import os
+import struct
+import threading
+import time
+import zlib
+from config import Config
+from utils import serialization
+
+# Messages are spooled here while the database is unavailable
+SPOOL_DIR = getattr(Config, 'SPOOL_DIR', os.path.join('storage', 'spool'))
+# A new segment file is started once the current one reaches this size
+SEGMENT_SIZE = getattr(Config, 'SPOOL_SEGMENT_SIZE', 4 * 1024 * 1024)
+# fsync after this many records or this many seconds, whichever comes first
+FSYNC_EVERY = getattr(Config, 'SPOOL_FSYNC_EVERY', 32)
+FSYNC_INTERVAL = getattr(Config, 'SPOOL_FSYNC_INTERVAL', 0.05)
+
+# Record layout: payload length, CRC32 of the payload, JSON payload
+_HEADER = struct.Struct('>II')
+
+def _segment_name(seq):
+    return f"segment-{seq:012d}.log"
+
+class MessageSpool:
+    """Durable append-only queue of messages, stored as checksummed segment files"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._file = None
+        self._seq = None
+        # Bytes of complete records in the active segment
+        self._size = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self):
+        """Return the sequence numbers of all segment files, oldest first"""
+        seqs = []
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name.endswith('.log'):
+                seqs.append(int(name[8:-4]))
+        return sorted(seqs)
+
+    def _path(self, seq):
+        return os.path.join(self.directory, _segment_name(seq))
+
+    def _open_segment(self, seq):
+        # Unbuffered, so a failed write never leaves bytes behind in a buffer
+        self._file = open(self._path(seq), 'ab', buffering=0)
+        self._seq = seq
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    def append(self, record):
+        """Append a record (a JSON-serializable dict)"""
+        payload = serialization.dumps_bytes(record)
+        data = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._lock:
+            if self._file is None:
+                segments = self._segments()
+                self._open_segment(segments[-1] + 1 if segments else 1)
+            elif self._size >= SEGMENT_SIZE:
+                # Seal the full segment, the drainer may delete it once replayed
+                self._sync()
+                self._file.close()
+                self._open_segment(self._seq + 1)
+
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[self._file.write(view):]
+            except OSError:
+                # Drop the partial record (e.g. disk full) so later records do
+                # not end up behind a torn one
+                self._discard_partial_write()
+                raise
+            self._size += len(data)
+            self._unsynced += 1
+
+            if (self._unsynced >= FSYNC_EVERY or
+                    time.monotonic() - self._last_sync >= FSYNC_INTERVAL):
+                self._sync()
+
+    def _discard_partial_write(self):
+        try:
+            os.ftruncate(self._file.fileno(), self._size)
+        except OSError:
+            # Cannot repair it: seal the segment, the next append starts a new one
+            self._file.close()
+            self._file = None
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def flush(self):
+        """fsync any records appended since the last sync"""
+        with self._lock:
+            self._sync()
+
+    def needs_flush(self):
+        """Return True if records are waiting for an fsync"""
+        return self._unsynced > 0
+
+    def _read_checkpoint(self):
+        """Return (segment, offset) of the first record not yet replayed"""
+        try:
+            with open(os.path.join(self.directory, 'checkpoint')) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _write_checkpoint(self, seq, offset):
+        path = os.path.join(self.directory, 'checkpoint')
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(f"{seq} {offset}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def has_pending(self):
+        """Return True if any record has not been replayed yet"""
+        with self._lock:
+            segments = self._segments()
+            if not segments:
+                return False
+            seq, offset = self._read_checkpoint()
+            last = segments[-1]
+            return seq < last or os.path.getsize(self._path(last)) > offset
+
+    def replay(self, handler):
+        """Feed pending records to handler in order, stopping when it returns False
+
+        Progress is checkpointed after every record, so a record is handed
+        out again only if the process dies between handling and checkpoint.
+        Returns the number of records handled.
+        """
+        self.flush()
+        handled = 0
+        checkpoint_seq, checkpoint_offset = self._read_checkpoint()
+
+        for seq in self._segments():
+            if seq < checkpoint_seq:
+                # Fully replayed earlier, only the file removal was missed
+                self._remove_segment(seq)
+                continue
+
+            offset = checkpoint_offset if seq == checkpoint_seq else 0
+            with self._lock:
+                # Never read past the records completed so far in the active
+                # segment, an append may be in progress behind them
+                limit = self._size if seq == self._seq and self._file is not None else None
+            with open(self._path(seq), 'rb') as f:
+                f.seek(offset)
+                while limit is None or offset < limit:
+                    header = f.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    length, checksum = _HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != checksum:
+                        # Torn write at the tail of a segment (crash mid-append)
+                        print(f"Spool segment {seq} has a corrupt record at offset {offset}")
+                        break
+
+                    if not handler(serialization.loads(payload)):
+                        return handled
+
+                    offset = f.tell()
+                    handled += 1
+                    self._write_checkpoint(seq, offset)
+
+            with self._lock:
+                is_active = seq == self._seq and self._file is not None
+                if is_active and self._size > offset:
+                    # More records arrived while replaying, pick them up next round
+                    return handled
+                if not is_active:
+                    self._remove_segment(seq)
+                    self._write_checkpoint(seq + 1, 0)
+
+        return handled
+
+    def _remove_segment(self, seq):
+        try:
+            os.remove(self._path(seq))
+        except FileNotFoundError:
+            pass
+
+_spool = None
+_spool_lock = threading.Lock()
+# Slots of workers that are gone, locked by this process until drained
+_adopted = {}
+_adopted_lock = threading.Lock()
+
+def get_spool():
+    """Return this process's spool, claiming a spool slot on first use"""
+    global _spool
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = MessageSpool(_claim_slot())
+    return _spool
+
+def flush_spool():
+    """fsync records appended since the last sync, if this process has a spool"""
+    if _spool is not None and _spool.needs_flush():
+        _spool.flush()
+
+def pending_spools():
+    """Return this process's spool and every orphaned slot, if they have records left
+
+    A slot no running worker holds (e.g. after the deployment shrank) is
+    locked and adopted, so its messages are replayed as well; it is released
+    again once empty.
+    """
+    own = get_spool()
+    with _adopted_lock:
+        for directory in _slot_directories():
+            if directory == own.directory or directory in _adopted:
+                continue
+            lock_file = _lock_slot(directory)
+            if lock_file is not None:
+                _adopted[directory] = (MessageSpool(directory), lock_file)
+
+        spools = [own] if own.has_pending() else []
+        for directory, (spool, lock_file) in list(_adopted.items()):
+            if spool.has_pending():
+                spools.append(spool)
+            else:
+                del _adopted[directory]
+                lock_file.close()
+        return spools
+
+def _slot_directories():
+    """Return the paths of all existing slot directories"""
+    try:
+        names = os.listdir(SPOOL_DIR)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(SPOOL_DIR, name) for name in sorted(names) if name.startswith('slot-')]
+
+def _lock_slot(directory):
+    """Return the slot's lock file locked by this process, or None if it is taken"""
+    lock_file = open(os.path.join(directory, 'lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def _claim_slot():
+    """Lock a slot directory so each worker appends to its own files
+
+    Slots are numbered, so a restarted worker takes over (and drains) the
+    files left behind by its predecessor; slots beyond the number of running
+    workers are drained through pending_spools.
+    """
+    slot = 0
+    while True:
+        directory = os.path.join(SPOOL_DIR, f"slot-{slot}")
+        os.makedirs(directory, exist_ok=True)
+        with _adopted_lock:
+            adopted = _adopted.pop(directory, None)
+        if adopted is not None:
+            # This process was draining the slot already, append to it as well
+            lock_file = adopted[1]
+        else:
+            lock_file = _lock_slot(directory)
+            if lock_file is None:
+                slot += 1
+                continue
+        # Keep the file open (and locked) for the lifetime of the process
+        _claim_slot.lock_file = lock_file
+        return directory
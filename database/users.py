@@ -1,6 +1,8 @@
 from database.connection import get_db_connection
+from database import queries
 from auth.utils import hash_password
 from utils.helpers import generate_invite_hash
+from database.invites import record_invite_lineage, remove_invite_lineage
 
 def get_user_by_id(user_id):
     """Get user data by ID"""
@@ -8,11 +10,7 @@ def get_user_by_id(user_id):
     cur = conn.cursor()
     
     try:
-        cur.execute("""
-            SELECT id, name, avatar_id
-            FROM user_data
-            WHERE id = %s
-        """, (user_id,))
+        queries.execute(cur, queries.USER_BY_ID, (user_id,))
         
         user = cur.fetchone()
         if user:
@@ -35,11 +33,7 @@ def get_user_by_name(username):
     cur = conn.cursor()
     
     try:
-        cur.execute("""
-            SELECT id, name, avatar_id, password_hash
-            FROM user_data
-            WHERE name = %s
-        """, (username,))
+        queries.execute(cur, queries.USER_BY_NAME, (username,))
         
         user = cur.fetchone()
         if user:
@@ -60,11 +54,12 @@ def get_user_by_name(username):
 def create_user(username, password, invite_code):
     """Create a new user with invitation code"""
     conn = get_db_connection()
+    conn.autocommit = False  # user, invite and lineage are written atomically
     cur = conn.cursor()
     
     try:
         # Check if username exists
-        cur.execute("SELECT id FROM user_data WHERE name = %s", (username,))
+        queries.execute(cur, queries.USER_ID_BY_NAME, (username,))
         if cur.fetchone():
             return None, "Username already exists"
 
@@ -105,6 +100,9 @@ def create_user(username, password, invite_code):
             (inviter_id, invitee_id, invite_hash)
             VALUES (%s, %s, %s)
         """, (inviter_id, new_user_id, invite_code))
+
+        # Record the new user's invite lineage
+        record_invite_lineage(cur, inviter_id, new_user_id)
         
         conn.commit()
         return new_user_id, None
@@ -208,6 +206,7 @@ def get_user_invite_codes(user_id):
 def delete_user_account(user_id):
     """Delete a user account and handle invitations"""
     conn = get_db_connection()
+    conn.autocommit = False  # all cleanup steps succeed or fail together
     cur = conn.cursor()
     
     try:
@@ -262,6 +261,9 @@ def delete_user_account(user_id):
                         WHERE id = %s
                     """, (new_invite_hash, inviter_id))
 
+        # Detach the user's invite subtree from its ancestors
+        remove_invite_lineage(cur, user_id)
+
         # Delete the invitation record
         cur.execute("DELETE FROM user_invites WHERE invitee_id = %s OR inviter_id = %s",
                     (user_id, user_id))
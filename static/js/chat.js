@@ -3,6 +3,14 @@
  * Main chat functionality
  */
 document.addEventListener("DOMContentLoaded", () => {
+  // Message send retry settings (exponential backoff)
+  const ACK_TIMEOUT_MS = 5000;
+  const MAX_SEND_ATTEMPTS = 6;
+  const RETRY_BASE_DELAY_MS = 500;
+  const RETRY_MAX_DELAY_MS = 15000;
+  // Keeps the socket from being evicted as idle by the server
+  const HEARTBEAT_INTERVAL_MS = 25000;
+
   // Global variables
   let currentUsername = "";
   let currentAvatarId = 1;
@@ -95,6 +103,13 @@ document.addEventListener("DOMContentLoaded", () => {
       socket.emit("auth", { username: currentUsername });
     });
 
+    // Heartbeat so the server can tell live idle sockets from dead ones
+    setInterval(() => {
+      if (socket.connected) {
+        socket.emit("heartbeat");
+      }
+    }, HEARTBEAT_INTERVAL_MS);
+
     // Connection error handler
     socket.on("connect_error", (error) => {
       console.error("Socket.IO connection error:", error);
@@ -119,6 +134,11 @@ document.addEventListener("DOMContentLoaded", () => {
     socket.on("message", (data) => {
       handleIncomingMessage(data);
     });
+
+    // Messages sent through the bulk send endpoint arrive as one batch
+    socket.on("message_batch", (messages) => {
+      messages.forEach(handleIncomingMessage);
+    });
   }
 
   /**
@@ -593,9 +613,10 @@ document.addEventListener("DOMContentLoaded", () => {
     const messageText = messageInput.value.trim();
     const timestamp = new Date().toISOString();
 
-    // Create message object
+    // Create message object; client_msg_id lets the server drop retried duplicates
     const message = {
       type: "message",
+      client_msg_id: generateClientMessageId(),
       from: currentUsername,
       to: activeChatUser,
       text: messageText,
@@ -604,7 +625,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
     // Send message via Socket.IO
     if (socket && socket.connected) {
-      socket.emit("message", message);
+      emitWithRetry("message", message);
 
       // Display own message on screen
       displayMessage(currentUsername, messageText, true, timestamp);
@@ -620,6 +641,49 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  /**
+   * Generates a unique ID for an outgoing message
+   * @returns {string} - Client message ID
+   */
+  function generateClientMessageId() {
+    if (window.crypto && typeof window.crypto.randomUUID === "function") {
+      return window.crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+  }
+
+  /**
+   * Emits an event and retries with exponential backoff until the server acknowledges it
+   * Safe because the server deduplicates by client_msg_id
+   * @param {string} event - Socket.IO event name
+   * @param {Object} payload - Event payload (must contain client_msg_id)
+   * @param {number} attempt - Number of previous attempts
+   */
+  function emitWithRetry(event, payload, attempt = 0) {
+    socket.timeout(ACK_TIMEOUT_MS).emit(event, payload, (err, ack) => {
+      // "queued" means the server spooled the message during a database outage
+      if (!err && ack && (ack.status === "ok" || ack.status === "queued")) {
+        return;
+      }
+
+      // The server answered with an error; resending the same data will not help
+      if (!err) {
+        showNotification("Send Error", (ack && ack.error) || "Message was not sent", "error");
+        return;
+      }
+
+      if (attempt + 1 >= MAX_SEND_ATTEMPTS) {
+        showNotification("Send Error", "Message could not be delivered", "error");
+        return;
+      }
+
+      // Backoff doubles per attempt, with jitter to spread out reconnect storms
+      const backoff = Math.min(RETRY_BASE_DELAY_MS * 2 ** attempt, RETRY_MAX_DELAY_MS);
+      const delay = backoff / 2 + Math.random() * (backoff / 2);
+      setTimeout(() => emitWithRetry(event, payload, attempt + 1), delay);
+    });
+  }
+
   /**
    * Displays messages in the chat
    * @param {string} sender - Message sender username
@@ -773,12 +837,15 @@ document.addEventListener("DOMContentLoaded", () => {
       }
 
       const response = await fetch(
-        `/get-message-history?username=${encodeURIComponent(username)}`
+        `/get-message-history?username=${encodeURIComponent(username)}&format=rows`
       );
 
       if (response.ok) {
         const data = await response.json();
-        const { messages } = data;
+        // Columnar response: each message is an array ordered like data.columns
+        const messages = data.messages.map((row) =>
+          Object.fromEntries(data.columns.map((column, i) => [column, row[i]]))
+        );
 
         if (chatMessages) {
           // Clear previous messages
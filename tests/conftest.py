@@ -0,0 +1,20 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import config  # noqa: F401
+except ImportError:
+    # config.py is deployment specific and not in the repository; the tests
+    # never reach a database, so placeholder settings are enough
+    class Config:
+        SECRET_KEY = 'test'
+        DB_HOST = '127.0.0.1'
+        DB_PORT = 5432
+        DB_NAME = 'test'
+        DB_USER = 'test'
+        DB_PASSWORD = 'test'
+
+    sys.modules['config'] = types.SimpleNamespace(Config=Config)
@@ -0,0 +1,133 @@
+import os
+import time
+import psycopg2
+import pytest
+from database import circuit, messages, spool
+
+class FakeDatabase:
+    """In-memory stand-in for _insert_message that can be taken down and brought back"""
+
+    def __init__(self):
+        self.down = False
+        self.fail_replay_at = None
+        self.stored = {}
+        self.replayed = []
+
+    def insert(self, sender, recipient, text, attachment_id=None, client_msg_id=None,
+               timestamp=None):
+        if timestamp is not None and self.fail_replay_at == len(self.replayed):
+            # The database dies again halfway through the replay
+            self.fail_replay_at = None
+            raise psycopg2.OperationalError("connection lost during replay")
+        if self.down:
+            raise psycopg2.OperationalError("could not connect to server")
+        duplicate = client_msg_id in self.stored
+        if not duplicate:
+            self.stored[client_msg_id] = text
+            if timestamp is not None:
+                self.replayed.append(client_msg_id)
+        return {'id': len(self.stored), 'timestamp': timestamp, 'duplicate': duplicate}
+
+@pytest.fixture
+def spool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool, 'SPOOL_DIR', str(tmp_path))
+    monkeypatch.setattr(spool, '_spool', None)
+    monkeypatch.setattr(spool, '_adopted', {})
+    return tmp_path
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = circuit.CircuitBreaker(failure_threshold=3, reset_timeout=0.01)
+    monkeypatch.setattr(messages, 'db_breaker', breaker)
+    return breaker
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(messages, '_insert_message', database.insert)
+    return database
+
+def drain_all():
+    """Drain until nothing is pending, as the background task would"""
+    deadline = time.monotonic() + 10
+    while spool.pending_spools() and time.monotonic() < deadline:
+        messages.drain_spooled_messages()
+        time.sleep(0.02)
+
+def test_outage_mid_load_loses_nothing(spool_dir, breaker, database):
+    count, outage_start, outage_length = 2000, 500, 500
+    queued = []
+    for i in range(count):
+        database.down = outage_start <= i < outage_start + outage_length
+        if i == outage_start + outage_length:
+            database.fail_replay_at = len(queued) // 2
+
+        result = messages.store_message_durable('alice', 'bob', f"message {i}",
+                                                client_msg_id=f"msg-{i}")
+        assert result is not None
+        if result.get('queued'):
+            queued.append(f"msg-{i}")
+        if i % 50 == 0:
+            messages.drain_spooled_messages()
+
+    drain_all()
+
+    assert queued
+    assert not spool.pending_spools()
+    assert database.stored == {f"msg-{i}": f"message {i}" for i in range(count)}
+    assert database.replayed == queued
+    assert breaker.state == 'closed'
+
+def test_drain_releases_probe_when_nothing_is_replayed(spool_dir, breaker, database):
+    # Only a torn record is pending, so the replay hands nothing to the database
+    directory = os.path.join(str(spool_dir), 'slot-0')
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'segment-000000000001.log'), 'wb') as f:
+        f.write(b'\x00\x00\x00\x10torn')
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.02)
+
+    assert breaker.state == 'half-open'
+    assert messages.drain_spooled_messages() == 0
+    assert breaker.state == 'closed'
+
+def test_failed_append_is_truncated(spool_dir):
+    message_spool = spool.MessageSpool(str(spool_dir))
+    message_spool.append({'n': 1})
+
+    class DiskFull:
+        def __init__(self, file):
+            self.file = file
+
+        def write(self, data):
+            self.file.write(bytes(data[:3]))
+            raise OSError(28, "No space left on device")
+
+        def fileno(self):
+            return self.file.fileno()
+
+    real_file = message_spool._file
+    message_spool._file = DiskFull(real_file)
+    with pytest.raises(OSError):
+        message_spool.append({'n': 2})
+    message_spool._file = real_file
+    message_spool.append({'n': 3})
+
+    records = []
+    message_spool.replay(lambda record: records.append(record) or True)
+    assert records == [{'n': 1}, {'n': 3}]
+
+def test_orphaned_slot_is_drained(spool_dir, breaker, database):
+    # A slot left behind by a worker that no longer runs
+    orphan = spool.MessageSpool(os.path.join(str(spool_dir), 'slot-5'))
+    orphan.append({'sender': 'alice', 'recipient': 'bob', 'text': 'left behind',
+                   'attachment_id': None, 'client_msg_id': 'orphan-1',
+                   'timestamp': '2026-01-01T00:00:00+00:00'})
+    orphan._file.close()
+
+    drain_all()
+
+    assert database.stored == {'orphan-1': 'left behind'}
+    assert not spool.pending_spools()
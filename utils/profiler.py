@@ -0,0 +1,220 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from functools import wraps
+from flask import g, request
+from config import Config
+
+try:
+    import greenlet
+except ImportError:
+    # Only needed to sample green threads (eventlet/gevent async modes)
+    greenlet = None
+
+# Sampling interval of the profiler thread, in seconds
+SAMPLE_INTERVAL = getattr(Config, 'PROFILER_SAMPLE_INTERVAL', 0.005)
+# Requests/events slower than this (ms) are kept with their samples and SQL
+SLOW_REQUEST_MS = getattr(Config, 'PROFILER_SLOW_REQUEST_MS', 500)
+MAX_SLOW_CAPTURES = 50
+MAX_SQL_PER_CAPTURE = 200
+MAX_STACK_DEPTH = 64
+
+# Profiling state; everything is off until an admin starts a window
+_enabled_until = 0.0
+_sample_rate = 1.0
+_slow_ms = SLOW_REQUEST_MS
+_stacks = Counter()
+_slow_captures = deque(maxlen=MAX_SLOW_CAPTURES)
+# thread id -> Profile of the request/event that thread is serving
+_active = {}
+_lock = threading.Lock()
+_sampler = None
+# True when eventlet/gevent turned threads into greenlets (set by start())
+_green = False
+
+class Profile:
+    """Samples and SQL timings collected for one request or socket event"""
+    __slots__ = ('name', 'started', 'stacks', 'sql', 'greenlet')
+
+    def __init__(self, name, greenlet=None):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+        self.sql = []
+        # The green thread serving the request, when threads are greenlets
+        self.greenlet = greenlet
+
+    def add_sql(self, statement, duration):
+        if len(self.sql) < MAX_SQL_PER_CAPTURE:
+            if isinstance(statement, bytes):
+                statement = statement.decode('utf-8', 'replace')
+            self.sql.append((' '.join(str(statement).split()), round(duration * 1000, 3)))
+
+def is_enabled():
+    """Return True while a profiling window is open"""
+    return bool(_enabled_until) and time.monotonic() < _enabled_until
+
+def start(duration, sample_rate=1.0, slow_ms=SLOW_REQUEST_MS):
+    """Open a profiling window for duration seconds on a share of requests"""
+    global _enabled_until, _sample_rate, _slow_ms, _sampler, _green
+    with _lock:
+        _stacks.clear()
+        _slow_captures.clear()
+        _sample_rate = sample_rate
+        _slow_ms = slow_ms
+        _green = _green_threads()
+        _enabled_until = time.monotonic() + duration
+
+        if _sampler is None or not _sampler.is_alive():
+            _sampler = threading.Thread(target=_sample_loop, name='profiler-sampler', daemon=True)
+            _sampler.start()
+
+def stop():
+    """Close the profiling window (collected data stays downloadable)"""
+    global _enabled_until
+    _enabled_until = 0.0
+
+def status():
+    """Return a summary of the profiler state"""
+    remaining = max(0.0, _enabled_until - time.monotonic()) if _enabled_until else 0.0
+    return {
+        'enabled': is_enabled(),
+        'remaining_seconds': round(remaining, 1),
+        'sample_rate': _sample_rate,
+        'slow_ms': _slow_ms,
+        'samples': _sample_count(),
+        'slow_captures': len(_slow_captures),
+        'stack_sampling': sampling_mode()
+    }
+
+def sampling_mode():
+    """Return how stacks are sampled: 'threads', 'greenlets' or 'unavailable'
+
+    Green threads can only be sampled while they are switched out (waiting
+    on I/O or yielding), CPU-bound stretches between switches go unseen.
+    """
+    if not _green_threads():
+        return 'threads'
+    return 'greenlets' if greenlet is not None else 'unavailable'
+
+def _green_threads():
+    """Return True when eventlet or gevent monkey patched threading"""
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            return True
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return True
+    return False
+
+def _sample_count():
+    with _lock:
+        return sum(_stacks.values())
+
+def current_profile():
+    """Return the profile of the request served by this thread, if it is sampled"""
+    if not _active:
+        return None
+    return _active.get(threading.get_ident())
+
+def begin(name):
+    """Start profiling the current request/event if the window and sample rate allow"""
+    if not is_enabled() or random.random() >= _sample_rate:
+        return None
+    profile = Profile(name, greenlet.getcurrent() if _green and greenlet is not None else None)
+    _active[threading.get_ident()] = profile
+    return profile
+
+def end(profile):
+    """Finish a profile, keeping it when it was slower than the threshold"""
+    _active.pop(threading.get_ident(), None)
+    elapsed_ms = (time.perf_counter() - profile.started) * 1000
+    if elapsed_ms >= _slow_ms:
+        with _lock:
+            stacks = dict(profile.stacks.most_common())
+            sql = list(profile.sql)
+        _slow_captures.append({
+            'name': profile.name,
+            'duration_ms': round(elapsed_ms, 3),
+            'sql': [{'statement': stmt, 'duration_ms': ms} for stmt, ms in sql],
+            'sql_total_ms': round(sum(ms for _, ms in sql), 3),
+            'stacks': stacks
+        })
+
+def profile_event(name):
+    """Decorator profiling a Socket.IO handler like a request"""
+    def decorator(handler):
+        @wraps(handler)
+        def wrapped(*args, **kwargs):
+            # Fast path: a single comparison while profiling is off
+            if not _enabled_until:
+                return handler(*args, **kwargs)
+            profile = begin(f"event:{name}")
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                if profile:
+                    end(profile)
+        return wrapped
+    return decorator
+
+def init_app(app):
+    """Profile sampled HTTP requests of a Flask app"""
+    @app.before_request
+    def profiler_before_request():
+        if _enabled_until:
+            g.profile = begin(f"{request.method} {request.path}")
+
+    @app.teardown_request
+    def profiler_teardown_request(exc):
+        profile = g.pop('profile', None)
+        if profile:
+            end(profile)
+
+def collapsed_stacks(capture_index=None):
+    """Return samples in collapsed-stack format (input for flamegraph.pl / speedscope)"""
+    # Copy under the lock, the sampler thread keeps adding stacks meanwhile
+    with _lock:
+        if capture_index is None:
+            stacks = dict(_stacks)
+        else:
+            stacks = dict(list(_slow_captures)[capture_index]['stacks'])
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.items())
+
+def slow_captures():
+    """Return the captured slow requests, most recent last"""
+    return list(_slow_captures)
+
+def _collapse(frame):
+    """Turn a frame into a 'root;...;leaf' stack string"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+def _sample_loop():
+    """Sample the stacks of threads serving profiled requests until the window closes"""
+    while is_enabled():
+        if _active:
+            frames = sys._current_frames()
+            for thread_id, profile in list(_active.items()):
+                if profile.greenlet is not None:
+                    # Under eventlet/gevent all greenlets share one OS thread;
+                    # gr_frame is where a switched-out greenlet will resume
+                    frame = profile.greenlet.gr_frame
+                else:
+                    frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = _collapse(frame)
+                    with _lock:
+                        profile.stacks[stack] += 1
+                        _stacks[stack] += 1
+        time.sleep(SAMPLE_INTERVAL)
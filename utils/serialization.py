@@ -0,0 +1,102 @@
+import datetime
+import decimal
+import json
+import sys
+import timeit
+from flask import current_app
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is the fallback
+    orjson = None
+
+def _default(obj):
+    """Encode types that neither backend handles natively"""
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+if orjson:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        """Serialize obj to UTF-8 encoded JSON"""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def dumps(obj, **kwargs):
+        """Serialize obj to a JSON string (extra stdlib-style arguments are ignored)"""
+        return dumps_bytes(obj).decode('utf-8')
+
+    def loads(s, **kwargs):
+        """Parse a JSON document"""
+        return orjson.loads(s)
+else:
+    def dumps(obj, **kwargs):
+        """Serialize obj to a JSON string (extra stdlib-style arguments are ignored)"""
+        return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False)
+
+    def dumps_bytes(obj):
+        """Serialize obj to UTF-8 encoded JSON"""
+        return dumps(obj).encode('utf-8')
+
+    def loads(s, **kwargs):
+        """Parse a JSON document"""
+        return json.loads(s)
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson when it is installed"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand the encoded bytes straight to the response, no str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
+
+def raw_json_response(body):
+    """Wrap an already serialized JSON document (str or bytes) in a response"""
+    return current_app.response_class(body, mimetype='application/json')
+
+def benchmark(rows=5000, number=20):
+    """Compare serialization paths for a message history page
+
+    stdlib json over dicts (the original path), the active backend over
+    dicts, and the active backend straight from row tuples (the columnar
+    format=rows response). The json_agg path needs a database and is not
+    measured here. Prints ms per page.
+    """
+    started = datetime.datetime(2026, 1, 1)
+    tuples = [(f"user{i % 7}", f"user{(i + 1) % 7}", f"message number {i} " * 4,
+               started + datetime.timedelta(seconds=i), None if i % 5 else i)
+              for i in range(rows)]
+    columns = ('from', 'to', 'text', 'timestamp', 'attachment_id')
+
+    def stdlib_dicts():
+        return json.dumps({'messages': [{'from': r[0], 'to': r[1], 'text': r[2],
+                                         'timestamp': r[3].isoformat(), 'attachment_id': r[4]}
+                                        for r in tuples]})
+
+    def backend_dicts():
+        return dumps_bytes({'messages': [dict(zip(columns, r)) for r in tuples]})
+
+    def backend_tuples():
+        return dumps_bytes({'columns': columns, 'messages': tuples})
+
+    backend = 'orjson' if orjson else 'stdlib'
+    results = {}
+    for name, func in (('stdlib, dicts', stdlib_dicts), (f"{backend}, dicts", backend_dicts),
+                       (f"{backend}, tuples", backend_tuples)):
+        results[name] = timeit.timeit(func, number=number) * 1000 / number
+        print(f"{name:<18} {results[name]:8.2f} ms per {rows}-row page")
+    return results
+
+if __name__ == '__main__':
+    # Usage: python -m utils.serialization [rows]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
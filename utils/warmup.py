@@ -0,0 +1,32 @@
+import time
+
+# Functions run once per worker before it starts serving requests
+_warmup_hooks = []
+
+def warmup_hook(func):
+    """Register a function(app) to run when a worker warms up"""
+    _warmup_hooks.append(func)
+    return func
+
+def run_warmup(app):
+    """Run all registered warmup hooks, reporting how long each one took"""
+    for hook in _warmup_hooks:
+        started = time.perf_counter()
+        try:
+            hook(app)
+        except Exception as e:
+            # A failed warmup only costs latency later, never the worker
+            print(f"Warmup hook {hook.__name__} failed: {e}")
+            continue
+        print(f"Warmup hook {hook.__name__} took {(time.perf_counter() - started) * 1000:.1f} ms")
+
+def track_first_request(app, started):
+    """Report time from worker start to the first served request"""
+    state = {'done': False}
+
+    @app.after_request
+    def report_first_request(response):
+        if not state['done']:
+            state['done'] = True
+            print(f"First request served {(time.perf_counter() - started) * 1000:.1f} ms after worker start")
+        return response
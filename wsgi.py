@@ -0,0 +1,9 @@
+# Entry point for WSGI servers, e.g. gunicorn -k eventlet -w 1 wsgi:app
+import time
+
+# Taken before the app is imported, import time is most of the startup cost
+process_started = time.perf_counter()
+
+from app import create_app
+
+app, socketio = create_app(process_started=process_started)